@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import *
+import compendium
+import lazy_compendium
+from pdf_convert import ShipSheet
+from ship_configuration import Army
+
+MANIFEST_KEYS = ["ship", "weapons", "crafts", "systems", "output", "fancy", "score"]
+
+def load_manifest(manifest_path: str, require_output: bool=True, allow_fancy: bool=True) -> List[dict]:
+    with open(manifest_path, "r") as manifest_file:
+        if manifest_path.lower().endswith(".jsonl"):
+            entries = [json.loads(line) for line in manifest_file if line.strip()]
+        else:
+            entries = json.load(manifest_file)
+    if isinstance(entries, dict):
+        entries = entries["sheets"]
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for index, entry in enumerate(entries):
+        if not entry.get("ship") or (require_output and not entry.get("output")):
+            raise ValueError(f"Manifest entry {index} must specify a `ship` and an `output`")
+        if entry.get("output") == "-":
+            raise ValueError(f"Manifest entry {index} cannot write to standard output in batch mode")
+        # every page of a fleet sheet shares the same fonts
+        if not allow_fancy and "fancy" in entry:
+            raise ValueError(f"Manifest entry {index} sets `fancy`, which fleet mode does not support, use -f/--fancy for the whole fleet")
+        unknown_keys = set(entry.keys()) - set(MANIFEST_KEYS)
+        if unknown_keys:
+            raise ValueError(f"Manifest entry {index} has unknown keys: {', '.join(sorted(unknown_keys))}")
+        # output paths are relative to the manifest, not the working directory
+        if entry.get("output"):
+            entry["output"] = os.path.join(base_dir, entry["output"])
+    return entries
+
+def render_entry(entry: dict, use_base_fonts: bool=True) -> str:
+    comp = compendium.get_compendium()
+    ship = comp.create_ship(entry["ship"], entry.get("weapons"), entry.get("crafts"), entry.get("systems"))
+    # a batch renders many sheets in each worker, which can then share font subsets
+    sheet = ShipSheet(use_base_fonts=use_base_fonts and not entry.get("fancy", False), pad_subsets=True)
+    sheet.create_sheet(ship, entry["output"])
+    return entry["output"]
+
+def run_batch(manifest_path: str, jobs: int=None, use_base_fonts: bool=True) -> int:
+    entries = load_manifest(manifest_path)
+    # load once up front so forked workers inherit the parsed compendium
+    comp = compendium.get_compendium()
+    failures = []
+    start_time = time.perf_counter()
+    if jobs == 1:
+        for index, entry in enumerate(entries):
+            try:
+                render_entry(entry, use_base_fonts)
+            except Exception as e:
+                failures.append((index, entry, e))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=lazy_compendium.init_worker,
+                initargs=(lazy_compendium.get_worker_settings(comp),)) as executor:
+            futures = {executor.submit(render_entry, entry, use_base_fonts): index for index, entry in enumerate(entries)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failures.append((index, entries[index], e))
+    elapsed = time.perf_counter() - start_time
+    for index, entry, error in sorted(failures, key=lambda failure: failure[0]):
+        print(f"[{index}] {entry['ship']} -> {entry['output']}: {type(error).__name__}: {error}", file=sys.stderr)
+    rendered = len(entries) - len(failures)
+    throughput = rendered / elapsed if elapsed > 0 else 0
+    print(f"Rendered {rendered}/{len(entries)} sheets in {elapsed:.2f}s ({throughput:.1f} sheets/s), {len(failures)} failed")
+    return 1 if failures else 0
+
+def run_fleet(manifest_path: str, output_path: str, max_points: int=None, use_base_fonts: bool=True) -> int:
+    entries = load_manifest(manifest_path, require_output=False, allow_fancy=False)
+    comp = compendium.get_compendium()
+    failures = []
+    ships = []
+    start_time = time.perf_counter()
+    for index, entry in enumerate(entries):
+        try:
+            ships.append(comp.create_ship(entry["ship"], entry.get("weapons"), entry.get("crafts"), entry.get("systems")))
+        except Exception as e:
+            failures.append((index, entry, e))
+    army = Army(max_points, ships)
+    if max_points is None:
+        army._max_points = army.get_point_cost()
+    # a single sheet renders every page, so fonts and presets are only set up once
+    sheet = ShipSheet(use_base_fonts=use_base_fonts)
+    if output_path == "-":
+        sheet.draw_fleet(army)
+        sheet.write_pdf(sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    else:
+        sheet.create_fleet_sheet(army, output_path)
+    elapsed = time.perf_counter() - start_time
+    for index, entry, error in failures:
+        print(f"[{index}] {entry['ship']}: {type(error).__name__}: {error}", file=sys.stderr)
+    print(f"Rendered a fleet of {len(ships)}/{len(entries)} ships ({army.get_point_cost()}/{army._max_points} points) in {elapsed:.2f}s, {len(failures)} failed", file=sys.stderr if output_path == "-" else sys.stdout)
+    return 1 if failures else 0
@@ -0,0 +1,258 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+from ship_configuration import *
+from compendium import Compendium
+import compendium
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is then left out of the results
+    resource = None
+
+BENCHMARK_VERSION = 1
+DEFAULT_THRESHOLD = 0.10
+FLEET_SIZE = 500
+FLEET_SEED = 500
+LOOKUP_COUNT = 20000
+# enough to measure equipping without taking minutes on a generated compendium
+EQUIP_HULLS = 20
+EQUIP_ELEMENTS = 500
+FLEET_ATTEMPTS = 20
+# the loadouts of the sheets under the examples directory
+EXAMPLE_LOADOUTS = [
+    {"ship": "Emblem", "weapons": ["Light Spinal Rail", "", "Coilgun", "Guardian Laser", "", "Coilgun"], "crafts": ["Chaff", "", "Tracking Beacon"],
+        "systems": ["Reactor Booster"]},
+    {"ship": "Elena"},
+]
+
+def get_peak_rss() -> int:
+    # in bytes, or None where the resource module is not available
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def build_fleet(comp: Compendium, size: int=FLEET_SIZE, seed: int=FLEET_SEED) -> Army:
+    # random but reproducible legal loadouts over the bundled hulls
+    rng = random.Random(seed)
+    templates = comp.get_ships()
+    weapons = comp.get_weapons()
+    crafts = comp.get_crafts()
+    slot_systems = comp.get_slot_systems()[:EQUIP_ELEMENTS]
+    ships = []
+    for index in range(size):
+        ship = rng.choice(templates).instantiate()
+        comp.equip_default_systems(ship)
+        # a few random picks rather than listing every compatible element, which is slow on large compendiums
+        for mount in ship._mounts:
+            weapon = next((weapon for weapon in (rng.choice(weapons) for attempt in range(FLEET_ATTEMPTS)) if mount.can_equip(weapon)), None)
+            if weapon:
+                mount.equip(weapon)
+        for bay in ship._bays:
+            craft = next((craft for craft in (rng.choice(crafts) for attempt in range(FLEET_ATTEMPTS)) if bay.can_equip(craft)), None)
+            if craft:
+                bay.equip(craft)
+        for system in rng.sample(slot_systems, len(slot_systems)):
+            if ship.can_equip(system):
+                ship.equip(system)
+        ships.append(ship)
+    army = Army(None, ships)
+    army._max_points = army.get_point_cost()
+    return army
+
+def get_lookup_names(names: List[str]) -> List[str]:
+    return [names[index % len(names)] for index in range(LOOKUP_COUNT)]
+
+def _lookup_weapons(names: List[str]):
+    comp = compendium.get_compendium()
+    for name in names:
+        comp.get_weapon(name)
+
+def _lookup_ships(names: List[str]):
+    comp = compendium.get_compendium()
+    for name in names:
+        comp.get_ship(name)
+
+def _equip_all(comp: Compendium):
+    weapons = comp.get_weapons()[:EQUIP_ELEMENTS]
+    crafts = comp.get_crafts()[:EQUIP_ELEMENTS]
+    for template in comp.get_ships()[:EQUIP_HULLS]:
+        ship = template.instantiate()
+        comp.equip_default_systems(ship)
+        for mount in ship._mounts:
+            for weapon in weapons:
+                if mount.can_equip(weapon):
+                    mount.equip(weapon)
+        for bay in ship._bays:
+            for craft in crafts:
+                if bay.can_equip(craft):
+                    bay.equip(craft)
+        for system in comp.get_slot_systems()[:EQUIP_ELEMENTS]:
+            if ship.can_equip(system):
+                ship.equip(system)
+                ship.unequip(system)
+
+def _render_examples(ships: List[Ship]):
+    from pdf_convert import ShipSheet
+    # rendering is measured without the disk
+    for ship in ships:
+        ShipSheet().create_sheet(ship, os.devnull)
+
+def _render_fancy(ships: List[Ship]):
+    from pdf_convert import ShipSheet
+    for ship in ships:
+        ShipSheet(use_base_fonts=False).create_sheet(ship, os.devnull)
+
+def _render_fleet(army: Army):
+    from pdf_convert import ShipSheet
+    ShipSheet().create_fleet_sheet(army, os.devnull)
+
+class Scenario():
+    # setup runs once and is not measured, run is measured on whatever setup returns
+    def __init__(self, name: str, description: str, run: Callable[[Any], Any], setup: Callable[[], Any]=None, repeat: int=5, warmup: bool=True):
+        self._name = name
+        self._description = description
+        self._run = run
+        self._setup = setup or (lambda: None)
+        self._repeat = repeat
+        self._warmup = warmup
+
+SCENARIOS = [
+    Scenario("compendium_cold", "First Compendium() in a new process, parsing every resource file", lambda state: Compendium(), repeat=1, warmup=False),
+    Scenario("compendium_warm", "Compendium() once the process has already built one", lambda state: Compendium()),
+    Scenario("compendium_snapshot", "Loading the cached compendium snapshot", lambda state: compendium.load_snapshot(),
+        setup=lambda: compendium.save_snapshot(Compendium())),
+    Scenario("lookup_weapons", f"{LOOKUP_COUNT} get_weapon calls, by exact and lowercase name", _lookup_weapons,
+        setup=lambda: get_lookup_names([name for weapon in compendium.get_compendium().get_weapons() for name in [weapon._name, weapon._name.lower()]])),
+    # exact names, then the short names users type on the command line
+    Scenario("lookup_ships", f"{LOOKUP_COUNT} get_ship calls, by full and short name", _lookup_ships,
+        setup=lambda: get_lookup_names([name for ship in compendium.get_compendium().get_ships() for name in [ship._name, ship._name.split("-")[0]]])),
+    Scenario("equip", f"Checking and equipping up to {EQUIP_ELEMENTS} weapons, crafts and slot systems on up to {EQUIP_HULLS} hulls", _equip_all,
+        setup=Compendium),
+    Scenario("render_examples", "ShipSheet.create_sheet for the loadouts under the examples directory", _render_examples,
+        setup=lambda: ([Compendium().create_ship(loadout["ship"], loadout.get("weapons"), loadout.get("crafts"), loadout.get("systems"))
+            for loadout in EXAMPLE_LOADOUTS])),
+    Scenario("render_fancy", "ShipSheet.create_sheet with the fancy fonts for the loadouts under the examples directory", _render_fancy,
+        setup=lambda: ([Compendium().create_ship(loadout["ship"], loadout.get("weapons"), loadout.get("crafts"), loadout.get("systems"))
+            for loadout in EXAMPLE_LOADOUTS])),
+    Scenario("render_fleet", f"ShipSheet.create_fleet_sheet for a synthetic {FLEET_SIZE} ship fleet", _render_fleet,
+        setup=lambda: build_fleet(Compendium()), repeat=3),
+]
+
+def run_scenario(name: str, repeat: int=None, resource_dir: str=None) -> dict:
+    if resource_dir:
+        compendium.set_resource_dir(resource_dir)
+    scenario = next(scenario for scenario in SCENARIOS if scenario._name == name)
+    repeat = repeat or scenario._repeat
+    state = scenario._setup()
+    if scenario._warmup:
+        scenario._run(state)
+    timings = []
+    for iteration in range(repeat):
+        start_time = time.perf_counter()
+        scenario._run(state)
+        timings.append(time.perf_counter() - start_time)
+    # allocations are measured on a separate run, tracing slows everything down
+    tracemalloc.start()
+    scenario._run(state)
+    allocated, peak_allocated = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "description": scenario._description,
+        "iterations": repeat,
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "mean_s": statistics.mean(timings),
+        "peak_allocated_bytes": peak_allocated,
+        "retained_bytes": allocated,
+        "peak_rss_bytes": get_peak_rss(),
+    }
+
+def run_benchmarks(names: List[str]=None, repeat: int=None, resource_dir: str=None) -> dict:
+    results = {}
+    # every scenario runs in a fresh process, so that caches and peak RSS do not carry over between scenarios
+    context = multiprocessing.get_context("spawn")
+    for scenario in SCENARIOS:
+        if names and scenario._name not in names:
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[scenario._name] = executor.submit(run_scenario, scenario._name, repeat, resource_dir).result()
+        print(f"{scenario._name}: {results[scenario._name]['median_s'] * 1000:.2f}ms", file=sys.stderr)
+    return {
+        "version": BENCHMARK_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "resources": resource_dir,
+        "scenarios": results,
+    }
+
+COMPARED_METRICS = ["median_s", "peak_allocated_bytes", "peak_rss_bytes"]
+
+def compare(baseline: dict, current: dict, threshold: float=DEFAULT_THRESHOLD) -> Tuple[List[dict], bool]:
+    # one row per scenario and metric, with the relative change from the baseline
+    rows = []
+    regressed = False
+    for name, result in current["scenarios"].items():
+        baseline_result = baseline["scenarios"].get(name)
+        if baseline_result is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = baseline_result.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            rows.append({"scenario": name, "metric": metric, "baseline": old, "current": new, "change": change, "regression": change > threshold})
+            regressed = regressed or change > threshold
+    return rows, regressed
+
+def format_value(metric: str, value: float) -> str:
+    if metric.endswith("_s"):
+        return f"{value * 1000:.2f}ms"
+    if value < 1024 * 1024:
+        return f"{value / 1024:.1f}KB"
+    return f"{value / (1024 * 1024):.2f}MB"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the benchmark scenarios and report timings, allocations and peak RSS as JSON.")
+    parser.add_argument("-s", "--scenarios", nargs="*", choices=[scenario._name for scenario in SCENARIOS], help="Only run these scenarios.")
+    parser.add_argument("-n", "--repeat", type=int, default=None, help="Number of measured runs of every scenario. Defaults to each scenario's own.")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file, e.g. to use as a baseline later.")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare the results to a baseline JSON file, and fail on regressions.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Relative increase counted as a regression in compare mode.")
+    parser.add_argument("--resources", help="Directory of list files to benchmark instead of the bundled compendium, e.g. from generator.py.")
+    parser.add_argument("-l", "--list", action="store_true", help="List the scenarios and exit.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.list:
+        for scenario in SCENARIOS:
+            print(f"{scenario._name}: {scenario._description}")
+        sys.exit(0)
+    results = run_benchmarks(args.scenarios, args.repeat, args.resources)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+    if not args.compare:
+        if not args.output:
+            print(json.dumps(results, indent=4))
+        sys.exit(0)
+    with open(args.compare, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+    rows, regressed = compare(baseline, results, args.threshold)
+    for row in rows:
+        marker = "REGRESSION" if row["regression"] else ""
+        print(f"{row['scenario']:<22} {row['metric']:<22} {format_value(row['metric'], row['baseline']):>12} -> "
+            f"{format_value(row['metric'], row['current']):>12} {row['change']:+8.1%} {marker}")
+    sys.exit(1 if regressed else 0)
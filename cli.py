@@ -1,33 +1,77 @@
 import argparse
-from ship_configuration import *
-from pdf_convert import ShipSheet
-import compendium
+import os
+import sys
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-s", "--ship", required=True, help="The name of the ship to use as a template. Ex: Emblem")
+    parser.add_argument("-s", "--ship", help="The name of the ship to use as a template. Ex: Emblem")
     parser.add_argument("-w", "--weapons", nargs="*", help="The names of weapons to assign to mounts, double-quoted and in order. Ex: \"Light Cannon\" \"Guardian Laser\"")
     parser.add_argument("-c", "--crafts", nargs="*", help="The names of crafts to assign to bays, double-quoted and in order. Ex: \"Light Missile\" \"Standard Torpedo\" \"Chaff\"")
     parser.add_argument("-y", "--systems", nargs="*", help="The names of all non-default systems to equip, double-quoted. Ex: \"Reinforced Magazine\" \"Radar Booster\"")
-    parser.add_argument("-o", "--output", required=True, help="Output file path for the character sheet PDF.")
+    parser.add_argument("-o", "--output", help="Output file path for the character sheet PDF. Use - to write the PDF to standard output.")
     parser.add_argument("-f", "--fancy", action="store_true", help="Provide this option to use fancy fonts. Requires the font files to be correctly set up - DO NOT USE with the packaged executable!")
-    return parser.parse_args()
+    parser.add_argument("-b", "--batch", help="Path to a JSON or JSONL manifest of sheets to render in one run. Replaces the -s, -w, -c, -y and -o options.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes to use in batch mode. Defaults to the number of CPUs.")
+    parser.add_argument("--fleet", help="Render every ship of the -b/--batch manifest into this single PDF, with a fleet summary page, instead of one file per entry.")
+    parser.add_argument("--max-points", type=int, default=None, help="Fleet point limit shown on the fleet summary page. Defaults to the fleet's total point cost.")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Rebuild the cached compendium snapshot from the resource files, even if it is up to date.")
+    parser.add_argument("--lazy", action="store_true", help="Only index the resource files at startup, and load each element the first time it is used.")
+    parser.add_argument("--resources", help="Directory of resource files to use instead of the bundled compendium, as list files, JSONL files or one file per element. Implies --lazy.")
+    parser.add_argument("--profile", action="store_true", help="Time each phase of the run, and print a report of the slowest phases to standard error on exit.")
+    parser.add_argument("--trace", help="Write the timings of each phase to this file as Chrome trace event JSON, to open in chrome://tracing or Perfetto.")
+    args = parser.parse_args()
+    single_sheet = args.ship or args.output
+    if not args.batch and (single_sheet or not args.rebuild_cache) and not (args.ship and args.output):
+        parser.error("the following arguments are required: -s/--ship, -o/--output (unless -b/--batch is used)")
+    if args.fleet and not args.batch:
+        parser.error("--fleet requires a -b/--batch manifest")
+    if args.rebuild_cache and (args.lazy or args.resources):
+        parser.error("--rebuild-cache cannot be combined with --lazy or --resources, lazy compendiums are not cached")
+    if args.max_points is not None and not args.fleet:
+        parser.error("--max-points requires --fleet")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j/--jobs must be at least 1")
+    return args
+
+def report_profile(profiler, print_report: bool, trace_path: str):
+    import profiling
+    if print_report:
+        print(profiler.format_flat_report(), file=sys.stderr)
+    if trace_path:
+        profiler.write(trace_path, profiling.CHROME)
 
 if __name__ == "__main__":
+    # modules are imported only once they are needed, so that -h, validate and cache rebuilds never load fpdf
+    if len(sys.argv) > 1 and sys.argv[1] == "validate":
+        import validator
+        sys.exit(validator.main(sys.argv[2:]))
     args = parse_args()
-    comp = compendium.get_compendium()
-    ship = comp.get_ship(args.ship)
-    comp.equip_default_systems(ship)
-    weapons = [comp.get_weapon(weapon) if weapon else None for weapon in args.weapons] if args.weapons else []
-    systems = [comp.get_system(system) for system in args.systems] if args.systems else []
-    crafts = [comp.get_craft(craft) if craft else None for craft in args.crafts] if args.crafts else []
-    for system in systems:
-        ship.equip(system)
-    for weapon, mount in zip(weapons, ship._mounts):
-        if weapon:
-            mount.equip(weapon)
-    for craft, bay in zip(crafts, ship._bays):
-        if craft:
-            bay.equip(craft)
+    if args.profile or args.trace:
+        import atexit
+        import profiling
+        # reported on exit, which the batch and fleet modes reach through sys.exit
+        atexit.register(report_profile, profiling.enable(), args.profile, args.trace)
+    import compendium
+    if args.lazy or args.resources:
+        import lazy_compendium
+        lazy_compendium.use_lazy_compendium(args.resources)
+    comp = compendium.get_compendium(rebuild_cache=args.rebuild_cache)
+    if not args.batch and not args.ship:
+        sys.exit(0)
+    if args.batch:
+        import batch
+        try:
+            if args.fleet:
+                sys.exit(batch.run_fleet(args.batch, args.fleet, args.max_points, use_base_fonts=not args.fancy))
+            sys.exit(batch.run_batch(args.batch, args.jobs, use_base_fonts=not args.fancy))
+        except ValueError as e:
+            # an invalid manifest is reported like invalid arguments, the entries themselves report their own errors
+            sys.exit(f"{os.path.basename(sys.argv[0])}: error: {e}")
+    ship = comp.create_ship(args.ship, args.weapons, args.crafts, args.systems)
+    from pdf_convert import ShipSheet
     sheet = ShipSheet(use_base_fonts=not args.fancy)
-    sheet.create_sheet(ship, args.output)
\ No newline at end of file
+    if args.output == "-":
+        sheet.write_sheet(ship, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    else:
+        sheet.create_sheet(ship, args.output)
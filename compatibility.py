@@ -0,0 +1,130 @@
+from typing import *
+from ship_configuration import *
+
+def get_mount_key(mount: Mount) -> tuple:
+    # the only mount attributes that decide which weapons fit
+    return (mount._size, mount._is_spinal_only, mount._equip_restrictions)
+
+def get_bay_key(bay: Bay) -> tuple:
+    return (bay._size, bay._equip_restrictions)
+
+# bytes 0 and 1 of a row as the digits of a base 2 number
+_ROW_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+def _row_to_bits(row: bytearray) -> int:
+    # the first position is the lowest bit
+    return int(bytes(reversed(row)).translate(_ROW_DIGITS), 2) if row else 0
+
+def _is_same_list(first: list, second: list) -> bool:
+    return len(first) == len(second) and all(a is b for a, b in zip(first, second))
+
+class CompatibilityMatrix():
+    # One row per kind of mount or bay, with a byte per weapon or craft of the compendium to test a single one in constant time.
+    # The rows are also kept as integer bitsets, to intersect whole rows at once.
+    def __init__(self, weapons: List[Weapon], crafts: List[Craft], ships: List[Ship]=None):
+        self._weapons = list(weapons)
+        self._crafts = list(crafts)
+        self._weapon_positions = {weapon: position for position, weapon in enumerate(self._weapons)}
+        self._craft_positions = {craft: position for position, craft in enumerate(self._crafts)}
+        self._mount_rows = {}
+        self._mount_bits = {}
+        self._mount_weapons = {}
+        self._bay_rows = {}
+        self._bay_bits = {}
+        self._bay_crafts = {}
+        # one mount or bay of each key, to compute the bitsets again for new weapons or crafts
+        self._mounts = {}
+        self._bays = {}
+        for ship in ships or []:
+            for mount in ship._mounts:
+                self.get_mount_row(mount)
+            for bay in ship._bays:
+                self.get_bay_row(bay)
+
+    def update(self, weapons: List[Weapon], crafts: List[Craft]) -> "CompatibilityMatrix":
+        # A matrix over new weapons and crafts, keeping the bitsets of whichever of the two did not change.
+        matrix = CompatibilityMatrix(weapons, crafts)
+        if _is_same_list(matrix._weapons, self._weapons):
+            matrix._weapons = self._weapons
+            matrix._weapon_positions = self._weapon_positions
+            matrix._mount_rows = dict(self._mount_rows)
+            matrix._mount_bits = dict(self._mount_bits)
+            matrix._mount_weapons = dict(self._mount_weapons)
+            matrix._mounts = dict(self._mounts)
+        else:
+            for mount in self._mounts.values():
+                matrix.get_mount_bits(mount)
+        if _is_same_list(matrix._crafts, self._crafts):
+            matrix._crafts = self._crafts
+            matrix._craft_positions = self._craft_positions
+            matrix._bay_rows = dict(self._bay_rows)
+            matrix._bay_bits = dict(self._bay_bits)
+            matrix._bay_crafts = dict(self._bay_crafts)
+            matrix._bays = dict(self._bays)
+        else:
+            for bay in self._bays.values():
+                matrix.get_bay_bits(bay)
+        return matrix
+
+    def get_mount_row(self, mount: Mount) -> bytearray:
+        key = get_mount_key(mount)
+        row = self._mount_rows.get(key)
+        if row is None:
+            # mounts that are not part of any hull are added on first use
+            row = bytearray(mount.can_equip(weapon) for weapon in self._weapons)
+            self._mount_weapons[key] = [weapon for weapon, compatible in zip(self._weapons, row) if compatible]
+            self._mount_bits[key] = _row_to_bits(row)
+            self._mount_rows[key] = row
+            self._mounts.setdefault(key, mount)
+        return row
+
+    def get_bay_row(self, bay: Bay) -> bytearray:
+        key = get_bay_key(bay)
+        row = self._bay_rows.get(key)
+        if row is None:
+            row = bytearray(bay.can_equip(craft) for craft in self._crafts)
+            self._bay_crafts[key] = [craft for craft, compatible in zip(self._crafts, row) if compatible]
+            self._bay_bits[key] = _row_to_bits(row)
+            self._bay_rows[key] = row
+            self._bays.setdefault(key, bay)
+        return row
+
+    def get_mount_bits(self, mount: Mount) -> int:
+        self.get_mount_row(mount)
+        return self._mount_bits[get_mount_key(mount)]
+
+    def get_bay_bits(self, bay: Bay) -> int:
+        self.get_bay_row(bay)
+        return self._bay_bits[get_bay_key(bay)]
+
+    def get_compatible_weapons(self, mount: Mount) -> List[Weapon]:
+        self.get_mount_row(mount)
+        return list(self._mount_weapons[get_mount_key(mount)])
+
+    def get_compatible_crafts(self, bay: Bay) -> List[Craft]:
+        self.get_bay_row(bay)
+        return list(self._bay_crafts[get_bay_key(bay)])
+
+    def can_equip_weapon(self, mount: Mount, weapon: Weapon) -> bool:
+        position = self._weapon_positions.get(weapon)
+        if position is None:
+            return mount.can_equip(weapon)
+        return bool(self.get_mount_row(mount)[position])
+
+    def can_equip_craft(self, bay: Bay, craft: Craft) -> bool:
+        position = self._craft_positions.get(craft)
+        if position is None:
+            return bay.can_equip(craft)
+        return bool(self.get_bay_row(bay)[position])
+
+    def filter_weapons(self, mount: Mount, weapons: List[Weapon]) -> List[Weapon]:
+        row = self.get_mount_row(mount)
+        positions = self._weapon_positions
+        return [weapon for weapon in weapons
+            if (row[positions[weapon]] if weapon in positions else mount.can_equip(weapon))]
+
+    def filter_crafts(self, bay: Bay, crafts: List[Craft]) -> List[Craft]:
+        row = self.get_bay_row(bay)
+        positions = self._craft_positions
+        return [craft for craft in crafts
+            if (row[positions[craft]] if craft in positions else bay.can_equip(craft))]
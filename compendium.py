@@ -1,14 +1,58 @@
 from utils import *
 from ship_configuration import *
+from query import *
+from compatibility import *
+import profiling
+import copy
 import json
+import hashlib
+import os
+import pickle
+import sys
 from typing import *
 
+def build_name_indexes(elements: list) -> Tuple[dict, dict]:
+    by_name = {}
+    by_lower_name = {}
+    # the first element wins on duplicate names, as with a linear scan
+    for element in elements:
+        by_name.setdefault(element._name, element)
+        by_lower_name.setdefault(element._name.lower(), element)
+    return by_name, by_lower_name
+
+def get_element_hash(json_obj: dict) -> str:
+    return hashlib.sha1(json.dumps(json_obj, sort_keys=True).encode()).hexdigest()
+
+def get_section_hashes(json_list: List[dict]) -> Dict[str, str]:
+    hashes = {}
+    for json_obj in json_list:
+        hashes.setdefault(json_obj.get("name"), get_element_hash(json_obj))
+    return hashes
+
+class CompendiumDiff():
+    # Names of the elements of one resource file that were added, changed or removed by a reload.
+    def __init__(self, path: str, added: List[str]=None, changed: List[str]=None, removed: List[str]=None):
+        self._path = path
+        self._added = added or []
+        self._changed = changed or []
+        self._removed = removed or []
+
+    def is_empty(self) -> bool:
+        return not (self._added or self._changed or self._removed)
+
+    def get_names(self) -> Set[str]:
+        return set(self._added) | set(self._changed) | set(self._removed)
+
+    def to_json(self) -> dict:
+        return {"path": self._path, "added": self._added, "changed": self._changed, "removed": self._removed}
+
 class Compendium():
 
     WEAPON_LIST = "./resources/weapon_list.json"
     CRAFT_LIST = "./resources/craft_list.json"
     SYSTEM_LIST = "./resources/system_list.json"
     SHIP_LIST = "./resources/ship_list.json"
+    SHIP_QUERY_CACHE_SIZE = 1024
 
     def __init__(self):
         self._weapons = []
@@ -17,36 +61,159 @@ class Compendium():
         self._default_systems = []
         self._ship_templates = []
         self._crafts = []
+        self._systems = []
+        # per (resource file, section): the hash of each element's JSON and the elements, to diff reloads by name
+        # hashing is only needed to reload, so it is left to track_changes
+        self._element_hashes = None
+        self._sections = {}
         self.load_systems()
         self.load_weapons()
         self.load_ships()
         self.load_crafts()
+        self.build_query_indexes()
+        self.build_compatibility()
 
     def load_weapons(self):
-        with open(Compendium.WEAPON_LIST, "r") as weapons_file:
+        with profiling.span("compendium.parse", path=Compendium.WEAPON_LIST), open(Compendium.WEAPON_LIST, "r") as weapons_file:
             weapon_list_obj = json.load(weapons_file)
-        weapon_list = weapon_list_obj["weapons"]
-        self._weapons = [Weapon.from_json(weapon) for weapon in weapon_list]
-    
+        self._weapons = self.load_section(Compendium.WEAPON_LIST, "weapons", weapon_list_obj["weapons"], Weapon.from_json)
+        self._weapons_by_name, self._weapons_by_lower_name = build_name_indexes(self._weapons)
+
+    def load_section(self, path: str, section: str, json_list: List[dict], from_json: Callable) -> list:
+        if self._element_hashes is None:
+            with profiling.span("compendium.from_json", path=path, section=section, count=len(json_list)):
+                elements = [from_json(json_obj) for json_obj in json_list]
+            self._sections[(path, section)] = elements
+            return elements
+        # elements whose JSON did not change since the last load keep their identity
+        previous_hashes = self._element_hashes.get((path, section), {})
+        previous_elements = {}
+        for element in self._sections.get((path, section), []):
+            previous_elements.setdefault(element._name, element)
+        hashes = {}
+        elements = []
+        with profiling.span("compendium.from_json", path=path, section=section, count=len(json_list)):
+            for json_obj in json_list:
+                element_hash = get_element_hash(json_obj)
+                name = json_obj.get("name")
+                element = None
+                if name not in hashes and previous_hashes.get(name) == element_hash:
+                    element = previous_elements.get(name)
+                hashes.setdefault(name, element_hash)
+                elements.append(element or from_json(json_obj))
+        self._element_hashes[(path, section)] = hashes
+        self._sections[(path, section)] = elements
+        return elements
+
+    def track_changes(self):
+        # Hashes the elements of the resource files as they are now, so that later reloads only rebuild what changed.
+        if self._element_hashes is not None:
+            return
+        element_hashes = {}
+        for path in {path for path, section in self._sections}:
+            with open(path, "r") as resource_file:
+                resource_obj = json.load(resource_file)
+            for source, section in self._sections:
+                if source == path:
+                    element_hashes[(source, section)] = get_section_hashes(resource_obj[section])
+        self._element_hashes = element_hashes
+
+    def get_section_loaders(self) -> Dict[str, Callable]:
+        return {
+            os.path.abspath(Compendium.WEAPON_LIST): self.load_weapons,
+            os.path.abspath(Compendium.CRAFT_LIST): self.load_crafts,
+            os.path.abspath(Compendium.SYSTEM_LIST): self.load_systems,
+            os.path.abspath(Compendium.SHIP_LIST): self.load_ships,
+        }
+
+    def reload(self, path: str) -> Tuple["Compendium", CompendiumDiff]:
+        # Re-parses a single resource file into a copy of this compendium, which is left untouched for anyone still using it.
+        # Unchanged elements, and the indexes of the other files, are shared with the copy.
+        comp = copy.copy(self)
+        if self._element_hashes is not None:
+            comp._element_hashes = dict(self._element_hashes)
+        comp._sections = dict(self._sections)
+        loader = comp.get_section_loaders().get(os.path.abspath(path))
+        if loader is None:
+            raise ValueError(f"{path} is not a compendium resource file")
+        loader()
+        diff = CompendiumDiff(path)
+        if self._element_hashes is None:
+            # without hashes every element of the file was rebuilt, and those that are still there count as changed
+            for key, elements in comp._sections.items():
+                previous_elements = self._sections.get(key, [])
+                if elements is previous_elements:
+                    continue
+                names = {element._name: None for element in elements}
+                previous_names = {element._name: None for element in previous_elements}
+                diff._added.extend(name for name in names if name not in previous_names)
+                diff._changed.extend(name for name in names if name in previous_names)
+                diff._removed.extend(name for name in previous_names if name not in names)
+        for (source, section), hashes in (comp._element_hashes or {}).items():
+            previous_hashes = self._element_hashes.get((source, section), {})
+            if hashes is previous_hashes:
+                continue
+            diff._added.extend(name for name in hashes if name not in previous_hashes)
+            diff._changed.extend(name for name, element_hash in hashes.items() if previous_hashes.get(name, element_hash) != element_hash)
+            diff._removed.extend(name for name in previous_hashes if name not in hashes)
+        if diff.is_empty():
+            return self, diff
+        comp._query_indexes = dict(self._query_indexes)
+        if loader == comp.load_weapons:
+            comp._query_indexes[Weapon] = QueryIndex(comp._weapons, WEAPON_FIELDS)
+        elif loader == comp.load_crafts:
+            comp._query_indexes[Craft] = QueryIndex(comp._crafts, CRAFT_FIELDS)
+        elif loader == comp.load_systems:
+            comp._query_indexes[ShipSystem] = QueryIndex(comp._systems, SYSTEM_FIELDS)
+        else:
+            comp._query_indexes[Ship] = QueryIndex(comp._ship_templates, SHIP_FIELDS)
+        # mounts and bays of new hulls are added to the matrix on first use
+        comp._compatibility = self._compatibility.update(comp._weapons, comp._crafts)
+        return comp, diff
+
+    @profiling.traced("compendium.build_query_indexes")
+    def build_query_indexes(self):
+        self._query_indexes = {
+            Weapon: QueryIndex(self._weapons, WEAPON_FIELDS),
+            Craft: QueryIndex(self._crafts, CRAFT_FIELDS),
+            ShipSystem: QueryIndex(self._systems, SYSTEM_FIELDS),
+            Ship: QueryIndex(self._ship_templates, SHIP_FIELDS),
+        }
+
+    @profiling.traced("compendium.build_compatibility")
+    def build_compatibility(self):
+        self._compatibility = CompatibilityMatrix(self._weapons, self._crafts, self._ship_templates)
+
+    def get_compatible_weapons(self, mount: Mount) -> List[Weapon]:
+        return self._compatibility.get_compatible_weapons(mount)
+
+    def get_compatible_crafts(self, bay: Bay) -> List[Craft]:
+        return self._compatibility.get_compatible_crafts(bay)
+
+    def query(self, element_type: type, **filters) -> list:
+        for base_type, query_index in self._query_indexes.items():
+            if issubclass(element_type, base_type):
+                return query_index.query(element_type, **filters)
+        raise ValueError(f"Cannot query elements of type {element_type.__name__}")
+
     def get_weapons(self, predicate: Callable[[Weapon], bool]=lambda w : True) -> List[Weapon]:
         return [weapon for weapon in self._weapons if predicate(weapon)]
 
     def get_weapon(self, name: str) -> Weapon:
-        for weapon in self._weapons:
-            if weapon._name == name:
-                return weapon
-        return None
+        if name is None:
+            return None
+        return self._weapons_by_name.get(name) or self._weapons_by_lower_name.get(name.lower())
     
     def load_systems(self):
-        with open(Compendium.SYSTEM_LIST, "r") as systems_file:
+        with profiling.span("compendium.parse", path=Compendium.SYSTEM_LIST), open(Compendium.SYSTEM_LIST, "r") as systems_file:
             system_list_obj = json.load(systems_file)
-        slot_system_list = system_list_obj["slots"]
-        self._slot_systems = [ShipSystem.from_json(system) for system in slot_system_list]
-        default_system_list = system_list_obj["default"]
-        self._default_systems = [ShipSystem.from_json(system) for system in default_system_list]
+        self._slot_systems = self.load_section(Compendium.SYSTEM_LIST, "slots", system_list_obj["slots"], ShipSystem.from_json)
+        self._default_systems = self.load_section(Compendium.SYSTEM_LIST, "default", system_list_obj["default"], ShipSystem.from_json)
+        self._systems = self._default_systems + self._slot_systems
+        self._systems_by_name, self._systems_by_lower_name = build_name_indexes(self._systems)
     
     def get_systems(self, predicate: Callable[[ShipSystem], bool]=lambda w : True) -> List[ShipSystem]:
-        return [system for system in self._default_systems + self._slot_systems if predicate(system)]
+        return [system for system in self._systems if predicate(system)]
     
     def get_default_systems(self, predicate: Callable[[ShipSystem], bool]=lambda w : True) -> List[ShipSystem]:
         return [system for system in self._default_systems if predicate(system)]
@@ -55,53 +222,168 @@ class Compendium():
         return [system for system in self._slot_systems if predicate(system)]
 
     def get_system(self, name: str) -> ShipSystem:
-        for system in self.get_systems():
-            if system._name == name:
-                return system
-        return None
+        if name is None:
+            return None
+        return self._systems_by_name.get(name) or self._systems_by_lower_name.get(name.lower())
     
     def equip_default_systems(self, ship: Ship):
         for system in self.get_default_systems():
             ship.equip(system)
+
+    @profiling.traced("compendium.create_loadout_ship")
+    def create_loadout_ship(self, loadout: Loadout) -> Ship:
+        template = self.get_ship(loadout._ship_name)
+        if template is None:
+            raise ValueError(f"Ship {loadout._ship_name} does not exist in the compendium")
+        ship = template.instantiate()
+        self.equip_default_systems(ship)
+        return loadout.equip(ship)
+
+    @profiling.traced("compendium.create_ship")
+    def create_ship(self, ship_name: str, weapon_names: List[str]=None, craft_names: List[str]=None, system_names: List[str]=None) -> Ship:
+        template = self.get_ship(ship_name)
+        if template is None:
+            raise ValueError(f"Ship {ship_name} does not exist in the compendium")
+        ship = template.instantiate()
+        self.equip_default_systems(ship)
+        for system_name in system_names or []:
+            system = self.get_system(system_name)
+            if system is None:
+                raise ValueError(f"System {system_name} does not exist in the compendium")
+            ship.equip(system)
+        for weapon_name, mount in zip(weapon_names or [], ship._mounts):
+            if not weapon_name:
+                continue
+            weapon = self.get_weapon(weapon_name)
+            if weapon is None:
+                raise ValueError(f"Weapon {weapon_name} does not exist in the compendium")
+            mount.equip(weapon)
+        for craft_name, bay in zip(craft_names or [], ship._bays):
+            if not craft_name:
+                continue
+            craft = self.get_craft(craft_name)
+            if craft is None:
+                raise ValueError(f"Craft {craft_name} does not exist in the compendium")
+            bay.equip(craft)
+        return ship
     
     def load_ships(self):
-        with open(Compendium.SHIP_LIST, "r") as ship_file:
+        with profiling.span("compendium.parse", path=Compendium.SHIP_LIST), open(Compendium.SHIP_LIST, "r") as ship_file:
             ship_list_obj = json.load(ship_file)
-        ship_list = ship_list_obj["ships"]
-        self._ship_templates = [Ship.from_json(ship) for ship in ship_list]
+        self._ship_templates = self.load_section(Compendium.SHIP_LIST, "ships", ship_list_obj["ships"], lambda ship: Ship.from_json(ship).freeze())
+        self._ships_by_name, self._ships_by_lower_name = build_name_indexes(self._ship_templates)
+        # partial names users type, with every ship whose name contains them
+        self._ship_queries = LRUCache(Compendium.SHIP_QUERY_CACHE_SIZE)
     
     def get_ships(self, predicate: Callable[[Ship], bool]=lambda w : True) -> List[Ship]:
         return [ship for ship in self._ship_templates if predicate(ship)]
 
     def get_ship(self, name: str) -> Ship:
-        for ship in self.get_ships():
-            if name in ship._name:
-                return ship
-        return None
+        if name is None:
+            return None
+        ship = self._ships_by_name.get(name) or self._ships_by_lower_name.get(name.lower())
+        if ship:
+            return ship
+        query = name.lower()
+        matches = self._ship_queries.get(query)
+        if matches is None:
+            # every ship containing the query counts, so that ambiguous names are always reported
+            matches = [ship for ship in self._ship_templates if query in ship._name.lower()]
+            self._ship_queries.put(query, matches)
+        if len(matches) > 1:
+            raise ValueError(f"Ship name {name} is ambiguous, it matches: {', '.join(ship._name for ship in matches)}")
+        return matches[0] if matches else None
     
     def load_crafts(self):
-        with open(Compendium.CRAFT_LIST, "r") as ship_file:
+        with profiling.span("compendium.parse", path=Compendium.CRAFT_LIST), open(Compendium.CRAFT_LIST, "r") as ship_file:
             craft_list_obj = json.load(ship_file)
-        deployable_list = craft_list_obj["deployables"]
-        payload_list = craft_list_obj["payloads"]
-        self._crafts.extend(Deployable.from_json(deployable) for deployable in deployable_list)
-        self._crafts.extend(Payload.from_json(payload) for payload in payload_list)
+        deployables = self.load_section(Compendium.CRAFT_LIST, "deployables", craft_list_obj["deployables"], Deployable.from_json)
+        payloads = self.load_section(Compendium.CRAFT_LIST, "payloads", craft_list_obj["payloads"], Payload.from_json)
+        self._crafts = deployables + payloads
+        self._crafts_by_name, self._crafts_by_lower_name = build_name_indexes(self._crafts)
     
     def get_crafts(self, predicate: Callable[[Ship], bool]=lambda w : True) -> List[Ship]:
         return [craft for craft in self._crafts if predicate(craft)]
 
     def get_craft(self, name: str) -> Craft:
-        for craft in self.get_crafts():
-            if name == craft._name:
-                return craft
+        if name is None:
+            return None
+        return self._crafts_by_name.get(name) or self._crafts_by_lower_name.get(name.lower())
+
+def set_resource_dir(resource_dir: str):
+    # use the list files of another directory, such as a compendium written by generator.py
+    for attribute in ["WEAPON_LIST", "CRAFT_LIST", "SYSTEM_LIST", "SHIP_LIST"]:
+        setattr(Compendium, attribute, os.path.join(resource_dir, os.path.basename(getattr(Compendium, attribute))))
+
+SNAPSHOT_VERSION = 3
+# edits to the model code must invalidate snapshots just like edits to the resource files
+SNAPSHOT_CODE_MODULES = ["utils", "ship_configuration", "query", "compatibility", __name__]
+
+def _hash_file(path: str) -> str:
+    with open(path, "rb") as source_file:
+        return hashlib.sha256(source_file.read()).hexdigest()
+
+def get_snapshot_sources() -> List[str]:
+    sources = [Compendium.WEAPON_LIST, Compendium.CRAFT_LIST, Compendium.SYSTEM_LIST, Compendium.SHIP_LIST]
+    sources.extend(sys.modules[module].__file__ for module in SNAPSHOT_CODE_MODULES)
+    return [os.path.abspath(source) for source in sources]
+
+def get_snapshot_path() -> str:
+    sources_key = hashlib.sha1("\n".join(get_snapshot_sources()).encode()).hexdigest()[:12]
+    return os.path.join(get_cache_dir(), f"compendium-{sources_key}.pickle")
+
+def _describe_source(path: str) -> dict:
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": _hash_file(path)}
+
+def _is_source_fresh(path: str, recorded: dict) -> bool:
+    stat = os.stat(path)
+    if stat.st_mtime_ns == recorded["mtime_ns"] and stat.st_size == recorded["size"]:
+        return True
+    # touched but possibly unchanged, e.g. after a checkout
+    return stat.st_size == recorded["size"] and _hash_file(path) == recorded["sha256"]
+
+def load_snapshot() -> Compendium:
+    try:
+        with open(get_snapshot_path(), "rb") as snapshot_file:
+            snapshot = pickle.load(snapshot_file)
+        if snapshot["version"] != SNAPSHOT_VERSION or set(snapshot["sources"].keys()) != set(get_snapshot_sources()):
+            return None
+        if not all(_is_source_fresh(path, recorded) for path, recorded in snapshot["sources"].items()):
+            return None
+        return snapshot["compendium"]
+    except Exception:
+        # a missing, stale or unreadable snapshot is simply rebuilt
         return None
 
+def save_snapshot(comp: Compendium):
+    snapshot_path = get_snapshot_path()
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "sources": {path: _describe_source(path) for path in get_snapshot_sources()},
+        "compendium": comp
+    }
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, snapshot_path)
+    except OSError:
+        pass
+
 compendium = None
 
-def get_compendium() -> Compendium:
+def get_compendium(rebuild_cache: bool=False) -> Compendium:
     global compendium
-    if not compendium:
-        compendium = Compendium()
+    if not compendium or rebuild_cache:
+        with profiling.span("compendium.load_snapshot"):
+            compendium = None if rebuild_cache else load_snapshot()
+        if not compendium:
+            with profiling.span("compendium.build"):
+                compendium = Compendium()
+            with profiling.span("compendium.save_snapshot"):
+                save_snapshot(compendium)
     return compendium
 
 if __name__ == "__main__":
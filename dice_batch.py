@@ -0,0 +1,59 @@
+import numpy as np
+from typing import *
+from utils import *
+from ship_configuration import *
+
+def get_weapon_dice(weapons: List[Weapon], counts: List[int]=None) -> Tuple[List[DiceExpr], List[DiceExpr]]:
+    counts = counts or [1] * len(weapons)
+    return [weapon.get_damage_dice() for weapon in weapons], [weapon.get_shots_dice() * count for weapon, count in zip(weapons, counts)]
+
+def get_craft_dice(crafts: List[Craft], counts: List[int]=None) -> Tuple[List[DiceExpr], List[DiceExpr]]:
+    counts = counts or [1] * len(crafts)
+    return [craft.get_damage_dice() for craft in crafts], [craft.get_swarm_dice() * count for craft, count in zip(crafts, counts)]
+
+def get_means(exprs: List[DiceExpr]) -> np.ndarray:
+    return np.fromiter((expr.mean() for expr in exprs), dtype=float, count=len(exprs))
+
+def get_variances(exprs: List[DiceExpr]) -> np.ndarray:
+    return np.fromiter((expr.variance() for expr in exprs), dtype=float, count=len(exprs))
+
+def get_pmf_matrix(exprs: List[DiceExpr], length: int=None) -> np.ndarray:
+    # row i holds the probability of each total 0..length-1 for exprs[i]
+    length = length or max(expr.get_max() for expr in exprs) + 1
+    unique = list(dict.fromkeys(exprs))
+    rows = np.zeros((len(unique), length))
+    for row, expr in enumerate(unique):
+        for total, probability in expr.distribution().items():
+            rows[row, total] = probability
+    positions = {expr: row for row, expr in enumerate(unique)}
+    return rows[[positions[expr] for expr in exprs]]
+
+def expected_damage(damage: List[DiceExpr], shots: List[DiceExpr]) -> np.ndarray:
+    return get_means(damage) * get_means(shots)
+
+def damage_variance(damage: List[DiceExpr], shots: List[DiceExpr]) -> np.ndarray:
+    # variance of a sum of a random number of independent rolls
+    damage_means = get_means(damage)
+    return get_means(shots) * get_variances(damage) + get_variances(shots) * damage_means * damage_means
+
+def damage_distributions(damage: List[DiceExpr], shots: List[DiceExpr]) -> np.ndarray:
+    # row i holds the probability of each total damage for one volley of weapon i,
+    # summing a rolled number of shots that each roll their own damage
+    if not damage:
+        return np.zeros((0, 1))
+    length = max(damage_expr.get_max() * shots_expr.get_max() for damage_expr, shots_expr in zip(damage, shots)) + 1
+    fft_size = 1 << (length - 1).bit_length()
+    damage_spectra = np.fft.rfft(get_pmf_matrix(damage), fft_size, axis=1)
+    shots_pmfs = get_pmf_matrix(shots)
+    # evaluate the generating function of the shot count at the damage spectra, with Horner's rule
+    spectra = np.repeat(shots_pmfs[:, -1:], damage_spectra.shape[1], axis=1).astype(complex)
+    for shot_count in range(shots_pmfs.shape[1] - 2, -1, -1):
+        spectra = spectra * damage_spectra + shots_pmfs[:, shot_count:shot_count + 1]
+    distributions = np.clip(np.fft.irfft(spectra, fft_size, axis=1)[:, :length], 0, None)
+    return distributions / distributions.sum(axis=1, keepdims=True)
+
+def roll_dice(rng: np.random.Generator, expr: DiceExpr, count: int) -> np.ndarray:
+    rolls = np.full(count, expr._constant, dtype=np.int64)
+    for dice_count, dice_size in expr._dice:
+        rolls += rng.integers(1, dice_size + 1, size=(count, dice_count)).sum(axis=1)
+    return rolls
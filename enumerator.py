@@ -0,0 +1,188 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+from ship_configuration import *
+from compatibility import CompatibilityMatrix
+from optimizer import MOUNT, BAY, SYSTEM, get_mount_signature, get_bay_signature
+from compendium import Compendium
+import compendium
+import lazy_compendium
+
+class SystemChoices():
+    # Every set of systems that fits in the free slots, indexed like a list without building it.
+    # counts[index][slots] is the number of sets made of the systems from index on that fit in that many slots.
+    def __init__(self, systems: List[ShipSystem], free_slots: int):
+        # sorted by slot cost, so that a set stops growing at the first system that does not fit
+        self._systems = sorted(systems, key=lambda system: system._slots)
+        self._counts = [[1] * (free_slots + 1) for index in range(len(self._systems) + 1)]
+        for index in range(len(self._systems) - 1, -1, -1):
+            cost = self._systems[index]._slots
+            for slots in range(free_slots + 1):
+                included = self._counts[index + 1][slots - cost] if cost <= slots else 0
+                self._counts[index][slots] = self._counts[index + 1][slots] + included
+        self._free_slots = free_slots
+
+    def __len__(self) -> int:
+        return self._counts[0][self._free_slots]
+
+    def __getitem__(self, position: int) -> Tuple[ShipSystem, ...]:
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        # the sets without a system come before those with it
+        subset = []
+        slots = self._free_slots
+        for index, system in enumerate(self._systems):
+            if position == 0 or system._slots > slots:
+                break
+            excluded = self._counts[index + 1][slots]
+            if position >= excluded:
+                position -= excluded
+                slots -= system._slots
+                subset.append(system)
+        return tuple(subset)
+
+class LoadoutSpace():
+    # Every legal loadout of a hull, as a mixed-radix number with one digit per group of identical mounts, bays or the systems.
+    def __init__(self, template: Ship, weapons: List[Weapon], crafts: List[Craft], systems: List[ShipSystem], include_systems: bool=True,
+            compatibility: CompatibilityMatrix=None):
+        compatibility = compatibility or CompatibilityMatrix(weapons, crafts)
+        self._template = template
+        self._groups = []
+        mount_groups = {}
+        for index, mount in enumerate(template._mounts):
+            mount_groups.setdefault(get_mount_signature(mount), []).append(index)
+        for indices in mount_groups.values():
+            compatible = [None] + compatibility.filter_weapons(template._mounts[indices[0]], weapons)
+            # identical mounts take a multiset of weapons rather than every ordering of it
+            self._groups.append((MOUNT, indices, list(itertools.combinations_with_replacement(compatible, len(indices)))))
+        bay_groups = {}
+        for index, bay in enumerate(template._bays):
+            bay_groups.setdefault(get_bay_signature(bay), []).append(index)
+        for indices in bay_groups.values():
+            compatible = [None] + compatibility.filter_crafts(template._bays[indices[0]], crafts)
+            self._groups.append((BAY, indices, list(itertools.combinations_with_replacement(compatible, len(indices)))))
+        if include_systems:
+            eligible = [system for system in systems if not template.has_system(system)
+                and (not system._ship_classes or template._class in system._ship_classes)]
+            self._groups.append((SYSTEM, [], SystemChoices(eligible, max(template.get_free_system_slots(), 0))))
+        self._sizes = [len(choices) for kind, indices, choices in self._groups]
+
+    def __len__(self) -> int:
+        return math.prod(self._sizes)
+
+    def get_loadout(self, digits: List[int]) -> Loadout:
+        weapons = [None] * len(self._template._mounts)
+        crafts = [None] * len(self._template._bays)
+        systems = []
+        for (kind, indices, choices), digit in zip(self._groups, digits):
+            choice = choices[digit]
+            if kind == MOUNT:
+                for index, weapon in zip(indices, choice):
+                    weapons[index] = weapon
+            elif kind == BAY:
+                for index, craft in zip(indices, choice):
+                    crafts[index] = craft
+            else:
+                systems = list(choice)
+        return Loadout(self._template._name, weapons, crafts, systems)
+
+    def iterate(self, start: int=0, stop: int=None) -> Iterator[Loadout]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+        # decode the start position, then count up like an odometer
+        digits = []
+        remainder = start
+        for size in reversed(self._sizes):
+            remainder, digit = divmod(remainder, size)
+            digits.append(digit)
+        digits.reverse()
+        for position in range(start, stop):
+            yield self.get_loadout(digits)
+            for group in range(len(digits) - 1, -1, -1):
+                digits[group] += 1
+                if digits[group] < self._sizes[group]:
+                    break
+                digits[group] = 0
+
+def create_loadout_space(comp: Compendium, ship_name: str, weapon_names: List[str]=None, craft_names: List[str]=None, include_systems: bool=True) -> LoadoutSpace:
+    template = comp.get_ship(ship_name)
+    if template is None:
+        raise ValueError(f"Ship {ship_name} does not exist in the compendium")
+    weapons = [comp.get_weapon(name) for name in weapon_names] if weapon_names else comp.get_weapons()
+    crafts = [comp.get_craft(name) for name in craft_names] if craft_names else comp.get_crafts()
+    if None in weapons or None in crafts:
+        raise ValueError("Some of the given weapons or crafts do not exist in the compendium")
+    return LoadoutSpace(template, weapons, crafts, comp.get_slot_systems(), include_systems, comp._compatibility)
+
+def enumerate_loadouts(comp: Compendium, ship_name: str, weapon_names: List[str]=None, craft_names: List[str]=None, include_systems: bool=True) -> Iterator[Loadout]:
+    return create_loadout_space(comp, ship_name, weapon_names, craft_names, include_systems).iterate()
+
+def _write_partition(part_path: str, start: int, stop: int, ship_name: str, weapon_names: List[str], craft_names: List[str], include_systems: bool) -> int:
+    space = create_loadout_space(compendium.get_compendium(), ship_name, weapon_names, craft_names, include_systems)
+    count = 0
+    with open(part_path, "w") as part_file:
+        for loadout in space.iterate(start, stop):
+            part_file.write(json.dumps(loadout.to_json()) + "\n")
+            count += 1
+    return count
+
+def write_loadouts(output_path: str, ship_name: str, weapon_names: List[str]=None, craft_names: List[str]=None, include_systems: bool=True,
+        jobs: int=None, partition_size: int=100000) -> int:
+    comp = compendium.get_compendium()
+    total = len(create_loadout_space(comp, ship_name, weapon_names, craft_names, include_systems))
+    ranges = [(start, min(start + partition_size, total)) for start in range(0, total, partition_size)]
+    part_paths = [f"{output_path}.part{index}" for index in range(len(ranges))]
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=lazy_compendium.init_worker,
+                initargs=(lazy_compendium.get_worker_settings(comp),)) as executor:
+            futures = [executor.submit(_write_partition, part_path, start, stop, ship_name, weapon_names, craft_names, include_systems)
+                for part_path, (start, stop) in zip(part_paths, ranges)]
+            count = sum(future.result() for future in futures)
+        with open(output_path, "w") as output_file:
+            for part_path in part_paths:
+                with open(part_path, "r") as part_file:
+                    shutil.copyfileobj(part_file, output_file)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    return count
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--ship", required=True, help="The name of the ship to enumerate loadouts for. Ex: Emblem")
+    parser.add_argument("-w", "--weapons", nargs="*", help="Only consider these weapons. Defaults to every weapon in the compendium.")
+    parser.add_argument("-c", "--crafts", nargs="*", help="Only consider these crafts. Defaults to every craft in the compendium.")
+    parser.add_argument("--no-systems", action="store_true", help="Only enumerate weapons and crafts, without slot systems.")
+    parser.add_argument("-o", "--output", help="Output JSONL file. Use - to stream loadouts to standard output.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes when writing to a file. Defaults to the number of CPUs.")
+    parser.add_argument("--count", action="store_true", help="Only print the number of legal loadouts.")
+    args = parser.parse_args()
+    if not args.count and not args.output:
+        parser.error("either -o/--output or --count is required")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    comp = compendium.get_compendium()
+    if args.count:
+        print(len(create_loadout_space(comp, args.ship, args.weapons, args.crafts, not args.no_systems)))
+    elif args.output == "-":
+        try:
+            for loadout in enumerate_loadouts(comp, args.ship, args.weapons, args.crafts, not args.no_systems):
+                sys.stdout.write(json.dumps(loadout.to_json()) + "\n")
+        except BrokenPipeError:
+            # the reader stopped early, e.g. `| head`
+            sys.stderr.close()
+    else:
+        start_time = time.perf_counter()
+        count = write_loadouts(args.output, args.ship, args.weapons, args.crafts, not args.no_systems, args.jobs)
+        print(f"Wrote {count} loadouts in {time.perf_counter() - start_time:.2f}s")
@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import *
+from utils import *
+from compendium import Compendium
+
+LIST = "list"
+JSONL = "jsonl"
+SPLIT = "split"
+LAYOUTS = [LIST, JSONL, SPLIT]
+
+# file and top-level key of every section, in the bundled list layout
+SECTION_FILES = {
+    "weapons": os.path.basename(Compendium.WEAPON_LIST),
+    "payloads": os.path.basename(Compendium.CRAFT_LIST),
+    "deployables": os.path.basename(Compendium.CRAFT_LIST),
+    "default": os.path.basename(Compendium.SYSTEM_LIST),
+    "slots": os.path.basename(Compendium.SYSTEM_LIST),
+    "ships": os.path.basename(Compendium.SHIP_LIST),
+}
+
+WEAPON_NOUNS = ["Laser", "Cannon", "Railgun", "Coilgun", "Autocannon", "Beam", "Lance", "Driver", "Flak Battery", "Jammer", "Mass Driver"]
+WEAPON_PREFIXES = ["Light", "Medium", "Heavy", "Twin", "Rapid", "Long", "Guardian", "Pulse", "Siege", "Point"]
+WEAPON_DAMAGE = ["1", "2", "3", "4", "1d3", "1d3+1", "1d6", "1d6+2", "2d6", "2d6+3", "3d6", "4d6"]
+WEAPON_TAGS = ["PD", "Reload 1", "Reload 2", "Accurate 1", "Accurate 2", "Inaccurate 1", "Shrapnel", "Reliable 2", "Breach 1", "Shred 1", "Shred 2",
+    "Lock 2", "Slow 3", "Shots 2", "Shots 4", "Shots 1d6", "Shots 2d6"]
+CRAFT_NOUNS = ["Missile", "Torpedo", "Interceptor", "Drone", "Mine", "Decoy", "Beacon"]
+CRAFT_PREFIXES = ["Gladiator", "Spartan", "Hoplite", "Sprint", "Standard", "Heavy", "Swift", "Silent"]
+PAYLOAD_TAGS = ["Reload 1", "Launch 3", "Launch 4", "Launch 5", "Sprints", "Phasing", "Lock 3", "Mayfly"]
+DEPLOYABLE_TAGS = ["PD", "Mayfly", "Highlander", "Jam 4", "Phasing"]
+SYSTEM_NOUNS = ["Magazine", "DC Locker", "Reactor", "Sensor Suite", "Shield Array", "Armour Plating", "Thrusters", "Targeting Computer"]
+SYSTEM_PREFIXES = ["Expanded", "Reinforced", "Bulk", "Boosted", "Hardened", "Auxiliary", "Military", "Prototype"]
+SHIP_WORDS = ["Aurora", "Bastion", "Cinder", "Dirge", "Ember", "Falcon", "Garnet", "Harbinger", "Ibis", "Jackal", "Kestrel", "Lantern", "Monarch",
+    "Nimbus", "Onyx", "Paladin", "Quasar", "Raven", "Sentinel", "Tempest", "Umbra", "Vigil", "Warden", "Zephyr"]
+SHIP_NOUNS = {ShipClass.ESCORT: ["Corvette", "Frigate"], ShipClass.LINE: ["Destroyer", "Cruiser"], ShipClass.CAPITAL: ["Battleship", "Carrier"]}
+# ranges of the stats, mount sizes and points of every ship class, after the bundled hulls
+SHIP_CLASS_RANGES = {
+    ShipClass.ESCORT: {"HP": (12, 28), "Shields": (4, 10), "Armour": (1, 3), "Evasion": (7, 11), "Speed": (5, 8), "Reactor": (4, 7), "Sensors": (3, 8),
+        "Signature": (3, 6), "Ammo": (12, 20), "Restores": (2, 3), "size": (1, 4), "points": (1, 2)},
+    ShipClass.LINE: {"HP": (30, 60), "Shields": (10, 18), "Armour": (3, 6), "Evasion": (5, 8), "Speed": (4, 6), "Reactor": (6, 10), "Sensors": (4, 7),
+        "Signature": (6, 9), "Ammo": (20, 28), "Restores": (3, 5), "size": (1, 4), "points": (3, 4)},
+    ShipClass.CAPITAL: {"HP": (60, 90), "Shields": (14, 22), "Armour": (6, 9), "Evasion": (3, 6), "Speed": (3, 5), "Reactor": (9, 14), "Sensors": (5, 8),
+        "Signature": (9, 12), "Ammo": (28, 40), "Restores": (5, 7), "size": (1, 5), "points": (5, 8)},
+}
+SHIP_STATS = ["HP", "Shields", "Armour", "Evasion", "Speed", "Reactor", "Sensors", "Signature", "Ammo", "Restores"]
+
+def generate_weapon(rng: random.Random, index: int) -> dict:
+    size = rng.choices([1, 2, 3, 4], weights=[4, 4, 2, 1])[0]
+    tags = rng.sample(WEAPON_TAGS, rng.randint(0, 3))
+    # at most one Shots tag, the first one found is the one that counts
+    shots = [tag for tag in tags if tag.startswith("Shots")]
+    tags = [tag for tag in tags if not tag.startswith("Shots")] + shots[:1]
+    if size >= 2 and rng.random() < 0.1:
+        tags.append("Spinal")
+    return {
+        "__type__": "Weapon",
+        "name": f"{rng.choice(WEAPON_PREFIXES)} {rng.choice(WEAPON_NOUNS)} Mk{index}",
+        "size": size,
+        "range": rng.choice([2, 4, 6, 8, 10, 12, 16, 20, 25]),
+        "power": rng.randint(0, 3),
+        "ammo": rng.randint(0, 2),
+        "ap": rng.randint(0, 4),
+        "damage": rng.choice(WEAPON_DAMAGE),
+        "tags": tags,
+    }
+
+def generate_craft_stats(rng: random.Random) -> dict:
+    return {"HP": rng.randint(0, 3), "Armour": rng.randint(0, 2), "Evasion": rng.randint(0, 12), "Speed": rng.randint(0, 10)}
+
+def generate_payload(rng: random.Random, index: int) -> dict:
+    noun = rng.choice(CRAFT_NOUNS[:3])
+    return {
+        "__type__": "Payload",
+        "name": f"{rng.choice(CRAFT_PREFIXES)} {noun} Mk{index}",
+        "size": rng.choices([1, 2, 3], weights=[4, 2, 1])[0],
+        "stats": generate_craft_stats(rng),
+        "power": 0,
+        "ammo": rng.randint(1, 2),
+        "ap": rng.randint(0, 3),
+        "damage": rng.choice(WEAPON_DAMAGE),
+        "tags": [noun, f"Swarm {rng.choice([1, 2, 3, 4, 8])}"] + rng.sample(PAYLOAD_TAGS, rng.randint(0, 2)),
+    }
+
+def generate_deployable(rng: random.Random, index: int) -> dict:
+    return {
+        "__type__": "Deployable",
+        "name": f"{rng.choice(CRAFT_PREFIXES)} {rng.choice(CRAFT_NOUNS[3:])} Mk{index}",
+        "size": rng.choice([1, 2]),
+        "stats": generate_craft_stats(rng),
+        "power": rng.randint(0, 1),
+        "ammo": rng.randint(0, 1),
+        "tags": ["Deployable"] + rng.sample(DEPLOYABLE_TAGS, rng.randint(0, 2)),
+    }
+
+def generate_slot_system(rng: random.Random, index: int) -> dict:
+    hp = rng.choice([0, 0, 0, 1, 2, 3])
+    ship_classes = rng.sample(list(ShipClass.__members__.keys()), rng.randint(1, 2)) if rng.random() < 0.2 else None
+    return {
+        "__type__": "ShipSystem",
+        "name": f"{rng.choice(SYSTEM_PREFIXES)} {rng.choice(SYSTEM_NOUNS)} Mk{index}",
+        "description": f"+{rng.randint(1, 4)} {rng.choice(SHIP_STATS)}",
+        "slots": rng.choices([1, 2, 3], weights=[6, 3, 1])[0],
+        "hp": hp,
+        "bubble_text": [f"{rng.choice(SHIP_STATS)} -{rng.randint(1, 2)}" for bubble in range(hp)],
+        "ship_classes": ship_classes,
+    }
+
+def generate_mount(rng: random.Random, max_size: int, spinal: bool) -> dict:
+    return {
+        "__type__": "Mount",
+        "size": max_size if spinal else rng.randint(1, max_size),
+        "count": 1 if spinal else rng.randint(1, 4),
+        "type": "FIXED" if spinal else rng.choice(list(MountType.__members__.keys())),
+        "position": "FORWARD" if spinal else rng.choice(list(MountPosition.__members__.keys())),
+        "spinal": spinal,
+        "weapon": None,
+    }
+
+def generate_bay(rng: random.Random, max_size: int) -> dict:
+    positions = list(MountPosition.__members__.keys())
+    return {
+        "__type__": "Bay",
+        "size": rng.randint(1, min(max_size, 3)),
+        "count": rng.randint(1, 4),
+        "positions": sorted(rng.sample(positions, rng.randint(1, 3)), key=positions.index),
+    }
+
+def generate_ship(rng: random.Random, index: int, name_words: List[str], mounts: Tuple[int, int], bays: Tuple[int, int], index_width: int=1) -> dict:
+    ship_class = rng.choice(list(ShipClass))
+    ranges = SHIP_CLASS_RANGES[ship_class]
+    max_size = rng.randint(*ranges["size"])
+    mount_count = rng.randint(*mounts)
+    # hulls with a spinal mount have it first, as in the bundled hulls
+    has_spinal = mount_count > 0 and rng.random() < 0.3
+    return {
+        "__type__": "Ship",
+        "name": f"{rng.choice(name_words)}{index:0{index_width}d}-Class {rng.choice(SHIP_NOUNS[ship_class])}",
+        "ship_class": ship_class.name,
+        "stats": {stat: rng.randint(*ranges[stat]) for stat in SHIP_STATS},
+        "system_slots": rng.randint(2, 4),
+        "point_cost": rng.randint(*ranges["points"]),
+        "traits": {},
+        "mounts": [generate_mount(rng, max_size, has_spinal and position == 0) for position in range(mount_count)],
+        "bays": [generate_bay(rng, max_size) for position in range(rng.randint(*bays))],
+    }
+
+def read_bundled_sections() -> Dict[str, list]:
+    sections = {}
+    for path in [Compendium.WEAPON_LIST, Compendium.CRAFT_LIST, Compendium.SYSTEM_LIST, Compendium.SHIP_LIST]:
+        with open(path, "r") as resource_file:
+            sections.update(json.load(resource_file))
+    return sections
+
+def generate_compendium(weapons: int=1000, crafts: int=100, systems: int=100, ships: int=100, mounts: Tuple[int, int]=(2, 10),
+        bays: Tuple[int, int]=(0, 4), seed: int=0, include_bundled: bool=True) -> Dict[str, list]:
+    # The elements of every section, generated in a fixed order so that a seed always gives the same compendium.
+    # The bundled elements come first, so that existing loadouts and names keep working.
+    rng = random.Random(seed)
+    bundled = read_bundled_sections()
+    # every ship needs its core systems, even without the other bundled elements
+    sections = bundled if include_bundled else dict({section: [] for section in SECTION_FILES}, default=bundled["default"])
+    # synthetic hull names must not make the short names of bundled hulls ambiguous
+    bundled_names = " ".join(ship["name"] for ship in sections["ships"]).lower()
+    name_words = [word for word in SHIP_WORDS if word.lower() not in bundled_names]
+    sections["weapons"] += [generate_weapon(rng, index) for index in range(weapons)]
+    payload_count = crafts * 3 // 4
+    sections["payloads"] += [generate_payload(rng, index) for index in range(payload_count)]
+    sections["deployables"] += [generate_deployable(rng, index) for index in range(payload_count, crafts)]
+    sections["slots"] += [generate_slot_system(rng, index) for index in range(systems)]
+    # padded numbers keep short names such as Aurora01 from matching Aurora012
+    sections["ships"] += [generate_ship(rng, index, name_words, mounts, bays, len(str(ships - 1))) for index in range(ships)]
+    return sections
+
+def write_compendium(sections: Dict[str, list], output_dir: str, layout: str=LIST) -> List[str]:
+    # Writes the sections in one of the layouts accepted by --resources, the list layout can also replace the bundled files.
+    paths = []
+    os.makedirs(output_dir, exist_ok=True)
+    if layout == LIST:
+        files = {}
+        for section, elements in sections.items():
+            files.setdefault(SECTION_FILES[section], {})[section] = elements
+        for file_name, file_sections in files.items():
+            paths.append(os.path.join(output_dir, file_name))
+            with open(paths[-1], "w") as output_file:
+                json.dump(file_sections, output_file, indent=4)
+    elif layout == JSONL:
+        for section, elements in sections.items():
+            paths.append(os.path.join(output_dir, f"{section}.jsonl"))
+            with open(paths[-1], "w") as output_file:
+                for element in elements:
+                    output_file.write(json.dumps(element) + "\n")
+    elif layout == SPLIT:
+        for section, elements in sections.items():
+            os.makedirs(os.path.join(output_dir, section), exist_ok=True)
+            for index, element in enumerate(elements):
+                paths.append(os.path.join(output_dir, section, f"{section}_{index:06d}.json"))
+                with open(paths[-1], "w") as output_file:
+                    json.dump(element, output_file, indent=4)
+    else:
+        raise ValueError(f"Unknown layout {layout}, expected one of {', '.join(LAYOUTS)}")
+    return paths
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a large, valid compendium for scale testing.")
+    parser.add_argument("-o", "--output", required=True, help="Directory to write the compendium to.")
+    parser.add_argument("--weapons", type=int, default=1000, help="Number of weapons to generate.")
+    parser.add_argument("--crafts", type=int, default=100, help="Number of crafts to generate, three quarters of them payloads.")
+    parser.add_argument("--systems", type=int, default=100, help="Number of slot systems to generate.")
+    parser.add_argument("--ships", type=int, default=100, help="Number of hulls to generate.")
+    parser.add_argument("--mounts", type=int, nargs=2, default=[2, 10], metavar=("MIN", "MAX"), help="Range of the number of mounts of every hull.")
+    parser.add_argument("--bays", type=int, nargs=2, default=[0, 4], metavar=("MIN", "MAX"), help="Range of the number of bays of every hull.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator, the same seed and counts give the same compendium.")
+    parser.add_argument("--layout", choices=LAYOUTS, default=LIST,
+        help="list writes files like the bundled ones, jsonl one file per section, split one file per element.")
+    parser.add_argument("--no-bundled", action="store_true", help="Leave out the bundled weapons, crafts, slot systems and hulls.")
+    args = parser.parse_args()
+    if args.mounts[0] < 0 or args.mounts[0] > args.mounts[1] or args.bays[0] < 0 or args.bays[0] > args.bays[1]:
+        parser.error("--mounts and --bays must be ranges of non-negative numbers, MIN first")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    start_time = time.perf_counter()
+    sections = generate_compendium(args.weapons, args.crafts, args.systems, args.ships, tuple(args.mounts), tuple(args.bays), args.seed, not args.no_bundled)
+    paths = write_compendium(sections, args.output, args.layout)
+    print(f"Wrote {sum(len(elements) for elements in sections.values())} elements to {len(paths)} files in {time.perf_counter() - start_time:.2f}s",
+        file=sys.stderr)
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import *
+
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.25
+IMPORTTIME_PREFIX = "import time:"
+
+class ImportCommand():
+    # a command line that must start without importing any of the forbidden modules
+    def __init__(self, name: str, argv: List[str], forbidden: List[str]):
+        self._name = name
+        self._argv = argv
+        self._forbidden = forbidden
+
+COMMANDS = [
+    ImportCommand("cli_help", ["cli.py", "-h"], ["tkinter", "fpdf", "compendium", "numpy"]),
+    ImportCommand("validate_help", ["validator.py", "-h"], ["tkinter", "fpdf", "numpy"]),
+    ImportCommand("cli_validate_help", ["cli.py", "validate", "-h"], ["tkinter", "fpdf", "numpy"]),
+    ImportCommand("pdf_convert", ["-c", "import pdf_convert"], ["tkinter", "compendium", "numpy"]),
+    ImportCommand("compendium", ["-c", "import compendium"], ["tkinter", "fpdf", "numpy"]),
+]
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    # (module, cumulative microseconds, nesting depth) of every import, in the order they finished
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith(IMPORTTIME_PREFIX):
+            continue
+        fields = line[len(IMPORTTIME_PREFIX):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            # the header line
+            continue
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        imports.append((module, int(fields[1]), (len(name) - len(module) - 1) // 2))
+    return imports
+
+def run_command(command: ImportCommand, repeat: int=DEFAULT_REPEAT) -> dict:
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    totals = []
+    modules = set()
+    for iteration in range(repeat):
+        process = subprocess.run([sys.executable, "-X", "importtime"] + command._argv, cwd=repo_dir, capture_output=True, text=True)
+        imports = parse_importtime(process.stderr)
+        modules = {module for module, cumulative, depth in imports}
+        # the cumulative times of top level imports already include everything they import
+        totals.append(sum(cumulative for module, cumulative, depth in imports if depth == 0) / 1e6)
+    forbidden = [module for module in command._forbidden if module in modules]
+    return {
+        "argv": command._argv,
+        "iterations": repeat,
+        "min_s": min(totals),
+        "median_s": statistics.median(totals),
+        "module_count": len(modules),
+        "forbidden_imports": forbidden,
+    }
+
+def run_checks(names: List[str]=None, repeat: int=DEFAULT_REPEAT) -> dict:
+    results = {}
+    for command in COMMANDS:
+        if names and command._name not in names:
+            continue
+        results[command._name] = run_command(command, repeat)
+        result = results[command._name]
+        print(f"{command._name}: {result['median_s'] * 1000:.2f}ms, {result['module_count']} modules", file=sys.stderr)
+    # the same layout as benchmark.py, so that its compare mode can be reused
+    return {"python": sys.version.split()[0], "scenarios": results}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check the import time of the command line entry points with python -X importtime.")
+    parser.add_argument("-s", "--commands", nargs="*", choices=[command._name for command in COMMANDS], help="Only check these commands.")
+    parser.add_argument("-n", "--repeat", type=int, default=DEFAULT_REPEAT, help="Number of runs of every command, the median is reported.")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file, e.g. to use as a baseline later.")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare the results to a baseline JSON file, and fail on regressions.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Relative increase counted as a regression in compare mode.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_checks(args.commands, args.repeat)
+    failed = False
+    for name, result in results["scenarios"].items():
+        if result["forbidden_imports"]:
+            print(f"{name} imports {', '.join(result['forbidden_imports'])}, which it should not need", file=sys.stderr)
+            failed = True
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+    elif not args.compare:
+        print(json.dumps(results, indent=4))
+    if args.compare:
+        from benchmark import compare, format_value
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        rows, regressed = compare(baseline, results, args.threshold)
+        for row in rows:
+            marker = "REGRESSION" if row["regression"] else ""
+            print(f"{row['scenario']:<22} {format_value(row['metric'], row['baseline']):>12} -> "
+                f"{format_value(row['metric'], row['current']):>12} {row['change']:+8.1%} {marker}")
+        failed = failed or regressed
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,314 @@
+import json
+import os
+import re
+from typing import *
+from utils import *
+from ship_configuration import *
+from query import *
+from compatibility import CompatibilityMatrix
+from compendium import Compendium
+import compendium
+
+WEAPON = "weapon"
+CRAFT = "craft"
+SYSTEM = "system"
+SHIP = "ship"
+
+ELEMENT_TYPES = {
+    "Weapon": (WEAPON, Weapon.from_json),
+    "Deployable": (CRAFT, Deployable.from_json),
+    "Payload": (CRAFT, Payload.from_json),
+    "ShipSystem": (SYSTEM, ShipSystem.from_json),
+    "Ship": (SHIP, lambda json_obj: Ship.from_json(json_obj).freeze()),
+}
+DEFAULT_SYSTEM_SECTIONS = {"default": True, "slots": False}
+RESOURCE_EXTENSIONS = (".json", ".jsonl")
+DEFAULT_CACHE_SIZE = 1024
+READ_CHUNK_SIZE = 1 << 20
+
+WHITESPACE_PATTERN = re.compile(r"[ \t\n\r]*")
+# top level fields of an element that are read while indexing
+INDEXED_FIELDS = ["name", "__type__", "slots"]
+
+def _get_indexed_fields(json_obj: dict) -> dict:
+    # non-ASCII bytes of the file are kept as one surrogate each, so that offsets are byte offsets,
+    # and only those are turned back into bytes here; characters from \u escapes are already decoded
+    return {field: json_obj[field].encode("utf-8", "surrogateescape").decode("utf-8") if isinstance(json_obj[field], str) else json_obj[field]
+        for field in INDEXED_FIELDS if field in json_obj}
+
+class ResourceReader():
+    # A window over a resource file, read in chunks so that memory stays bounded by the chunk and the largest element.
+    # Positions are byte offsets from the start of the file.
+    def __init__(self, resource_file: TextIO, chunk_size: int=READ_CHUNK_SIZE):
+        self._file = resource_file
+        self._chunk_size = chunk_size
+        self._text = ""
+        self._offset = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def read_more(self) -> bool:
+        chunk = "" if self._eof else self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._text += chunk
+        return True
+
+    def release(self, position: int):
+        # the text before position is never read again, it is dropped once there is a chunk of it
+        if position - self._offset > self._chunk_size:
+            self._text = self._text[position - self._offset:]
+            self._offset = position
+
+    def peek(self, position: int) -> str:
+        while position - self._offset >= len(self._text) and self.read_more():
+            pass
+        return self._text[position - self._offset:position - self._offset + 1]
+
+    def skip_whitespace(self, position: int) -> int:
+        while True:
+            end = WHITESPACE_PATTERN.match(self._text, position - self._offset).end()
+            if end < len(self._text) or not self.read_more():
+                return end + self._offset
+
+    def expect(self, position: int, expected: str) -> int:
+        if self.peek(position) != expected:
+            raise ValueError(f"Expected `{expected}` at byte {position}")
+        return self.skip_whitespace(position + 1)
+
+    def decode(self, position: int) -> Tuple[Any, int]:
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._text, position - self._offset)
+                # a value that ends with the window, e.g. a number, may go on in the next chunk
+                if end < len(self._text) or self._eof:
+                    return value, end + self._offset
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self.read_more()
+
+    def is_done(self, position: int) -> bool:
+        return self.peek(position) == ""
+
+def scan_elements(reader: ResourceReader) -> Iterator[Tuple[int, int, str, dict]]:
+    # Yields the byte span, section and indexed fields of every element, in any of the layouts:
+    # elements inside the top level arrays of a list file, one element per JSONL line, or one element per file.
+    # Only one element is decoded at a time, and it is dropped as soon as its fields are read.
+    position = reader.skip_whitespace(0)
+    while not reader.is_done(position):
+        start = position
+        reader.release(start)
+        key_position = reader.expect(position, "{")
+        if reader.peek(key_position) == '"':
+            # elements are decoded whole, list files start with an array and are walked one element at a time
+            key, value_position = reader.decode(key_position)
+            if reader.peek(reader.expect(reader.skip_whitespace(value_position), ":")) != "[":
+                json_obj, position = reader.decode(start)
+                if "__type__" in json_obj:
+                    yield start, position, None, _get_indexed_fields(json_obj)
+                    position = reader.skip_whitespace(position)
+                    continue
+        fields = {}
+        section_elements = []
+        position = reader.expect(position, "{")
+        while reader.peek(position) != "}":
+            key, position = reader.decode(position)
+            position = reader.expect(reader.skip_whitespace(position), ":")
+            if reader.peek(position) == "[":
+                position = reader.skip_whitespace(position + 1)
+                while reader.peek(position) != "]":
+                    element_start = position
+                    reader.release(element_start)
+                    value, position = reader.decode(position)
+                    if isinstance(value, dict):
+                        section_elements.append((element_start, position, key, _get_indexed_fields(value)))
+                    position = reader.skip_whitespace(position)
+                    if reader.peek(position) == ",":
+                        position = reader.skip_whitespace(position + 1)
+                position += 1
+            else:
+                value, position = reader.decode(position)
+                if key in INDEXED_FIELDS:
+                    fields.update(_get_indexed_fields({key: value}))
+            position = reader.skip_whitespace(position)
+            if reader.peek(position) == ",":
+                position = reader.skip_whitespace(position + 1)
+        position += 1
+        if "__type__" in fields:
+            # an element of its own, its arrays are mounts, tags and so on
+            yield start, position, None, fields
+        else:
+            yield from section_elements
+        position = reader.skip_whitespace(position)
+
+def get_resource_files(resource_dir: str) -> List[str]:
+    paths = []
+    for directory, subdirectories, file_names in os.walk(resource_dir):
+        subdirectories.sort()
+        paths.extend(os.path.join(directory, file_name) for file_name in sorted(file_names) if file_name.lower().endswith(RESOURCE_EXTENSIONS))
+    return paths
+
+class IndexEntry():
+    __slots__ = ("_path", "_start", "_end", "_type")
+
+    def __init__(self, path: str, start: int, end: int, element_type: str):
+        self._path = path
+        self._start = start
+        self._end = end
+        self._type = element_type
+
+    def load(self):
+        with open(self._path, "rb") as resource_file:
+            resource_file.seek(self._start)
+            json_obj = json.loads(resource_file.read(self._end - self._start))
+        return ELEMENT_TYPES[self._type][1](json_obj)
+
+class LazyCompendium(Compendium):
+    # Only indexes the resource files by name, elements are built on first use and kept in an LRU cache.
+    def __init__(self, resource_dir: str=None, cache_size: int=DEFAULT_CACHE_SIZE):
+        self._resource_dir = resource_dir or os.path.dirname(Compendium.WEAPON_LIST)
+        self._cache = LRUCache(cache_size)
+        # elements that must keep their identity, e.g. default systems equipped on every ship
+        self._pinned = {}
+        self._index = {WEAPON: {}, CRAFT: {}, SYSTEM: {}, SHIP: {}}
+        self._default_system_names = []
+        self._slot_system_names = []
+        self._compatibility_matrix = None
+        self._built_query_indexes = None
+        for path in get_resource_files(self._resource_dir):
+            self.index_file(path)
+        self._lower_names = {kind: {} for kind in self._index}
+        for kind, entries in self._index.items():
+            for name in entries:
+                self._lower_names[kind].setdefault(name.lower(), name)
+        self._default_systems = [self.pin(SYSTEM, name) for name in self._default_system_names]
+
+    def index_file(self, path: str):
+        with open(path, "r", encoding="ascii", errors="surrogateescape", newline="") as resource_file:
+            for start, end, section, fields in scan_elements(ResourceReader(resource_file)):
+                element_type = fields.get("__type__")
+                if element_type is None:
+                    continue
+                if element_type not in ELEMENT_TYPES or not fields.get("name"):
+                    raise ValueError(f"{path} at byte {start}: element must have a `name` and a `__type__` in {', '.join(ELEMENT_TYPES.keys())}")
+                kind = ELEMENT_TYPES[element_type][0]
+                name = fields["name"]
+                if name in self._index[kind]:
+                    # the first element wins on duplicate names, as in the eager compendium
+                    continue
+                self._index[kind][name] = IndexEntry(path, start, end, element_type)
+                if kind == SYSTEM:
+                    # outside of the bundled list files, systems that take no slots are default systems
+                    is_default = DEFAULT_SYSTEM_SECTIONS.get(section, fields.get("slots") == 0)
+                    (self._default_system_names if is_default else self._slot_system_names).append(name)
+
+    def get_names(self, kind: str) -> List[str]:
+        return list(self._index[kind].keys())
+
+    def materialize(self, kind: str, name: str):
+        key = (kind, name)
+        element = self._pinned.get(key) or self._cache.get(key)
+        if element is None:
+            element = self._index[kind][name].load()
+            self._cache.put(key, element)
+            if kind == SYSTEM:
+                # ships find their systems by identity, a system rebuilt after eviction would count as another one
+                self._pinned[key] = element
+        return element
+
+    def pin(self, kind: str, name: str):
+        element = self.materialize(kind, name)
+        self._pinned[(kind, name)] = element
+        return element
+
+    def resolve_name(self, kind: str, name: str) -> str:
+        if name is None:
+            return None
+        if name in self._index[kind]:
+            return name
+        return self._lower_names[kind].get(name.lower())
+
+    def get_weapons(self, predicate: Callable[[Weapon], bool]=lambda w : True) -> List[Weapon]:
+        return [weapon for weapon in (self.materialize(WEAPON, name) for name in self._index[WEAPON]) if predicate(weapon)]
+
+    def get_weapon(self, name: str) -> Weapon:
+        weapon_name = self.resolve_name(WEAPON, name)
+        return self.materialize(WEAPON, weapon_name) if weapon_name else None
+
+    def get_systems(self, predicate: Callable[[ShipSystem], bool]=lambda w : True) -> List[ShipSystem]:
+        return self.get_default_systems(predicate) + self.get_slot_systems(predicate)
+
+    def get_default_systems(self, predicate: Callable[[ShipSystem], bool]=lambda w : True) -> List[ShipSystem]:
+        return [system for system in self._default_systems if predicate(system)]
+
+    def get_slot_systems(self, predicate: Callable[[ShipSystem], bool]=lambda w : True) -> List[ShipSystem]:
+        return [system for system in (self.materialize(SYSTEM, name) for name in self._slot_system_names) if predicate(system)]
+
+    def get_system(self, name: str) -> ShipSystem:
+        system_name = self.resolve_name(SYSTEM, name)
+        return self.materialize(SYSTEM, system_name) if system_name else None
+
+    def get_ships(self, predicate: Callable[[Ship], bool]=lambda w : True) -> List[Ship]:
+        return [ship for ship in (self.materialize(SHIP, name) for name in self._index[SHIP]) if predicate(ship)]
+
+    def get_ship(self, name: str) -> Ship:
+        if name is None:
+            return None
+        ship_name = self.resolve_name(SHIP, name)
+        if not ship_name:
+            query = name.lower()
+            matches = [candidate for lower_name, candidate in self._lower_names[SHIP].items() if query in lower_name]
+            if len(matches) > 1:
+                raise ValueError(f"Ship name {name} is ambiguous, it matches: {', '.join(matches)}")
+            ship_name = matches[0] if matches else None
+        return self.materialize(SHIP, ship_name) if ship_name else None
+
+    def get_crafts(self, predicate: Callable[[Craft], bool]=lambda w : True) -> List[Craft]:
+        return [craft for craft in (self.materialize(CRAFT, name) for name in self._index[CRAFT]) if predicate(craft)]
+
+    def get_craft(self, name: str) -> Craft:
+        craft_name = self.resolve_name(CRAFT, name)
+        return self.materialize(CRAFT, craft_name) if craft_name else None
+
+    def reload(self, path: str):
+        raise ValueError("Lazy compendiums cannot be reloaded, create a new LazyCompendium instead")
+
+    @property
+    def _compatibility(self) -> CompatibilityMatrix:
+        # built on first use, which keeps every weapon and craft in memory
+        if self._compatibility_matrix is None:
+            weapons = [self.pin(WEAPON, name) for name in self._index[WEAPON]]
+            crafts = [self.pin(CRAFT, name) for name in self._index[CRAFT]]
+            self._compatibility_matrix = CompatibilityMatrix(weapons, crafts)
+        return self._compatibility_matrix
+
+    @property
+    def _query_indexes(self) -> Dict[type, QueryIndex]:
+        # built on first use, which keeps every element in memory
+        if self._built_query_indexes is None:
+            self._built_query_indexes = {
+                Weapon: QueryIndex([self.pin(WEAPON, name) for name in self._index[WEAPON]], WEAPON_FIELDS),
+                Craft: QueryIndex([self.pin(CRAFT, name) for name in self._index[CRAFT]], CRAFT_FIELDS),
+                ShipSystem: QueryIndex([self.pin(SYSTEM, name) for name in self._default_system_names + self._slot_system_names], SYSTEM_FIELDS),
+                Ship: QueryIndex([self.pin(SHIP, name) for name in self._index[SHIP]], SHIP_FIELDS),
+            }
+        return self._built_query_indexes
+
+def use_lazy_compendium(resource_dir: str=None, cache_size: int=DEFAULT_CACHE_SIZE) -> LazyCompendium:
+    # later calls to compendium.get_compendium() return the lazy compendium
+    compendium.compendium = LazyCompendium(resource_dir, cache_size)
+    return compendium.compendium
+
+def get_worker_settings(comp: Compendium) -> Optional[Tuple[str, int]]:
+    # worker processes started with spawn do not inherit the compendium, and need these to load the same one
+    if isinstance(comp, LazyCompendium):
+        return (comp._resource_dir, comp._cache._max_size)
+    return None
+
+def init_worker(lazy_settings: Optional[Tuple[str, int]]=None):
+    # forked workers already have the lazy compendium of their parent
+    if lazy_settings is not None and not isinstance(compendium.compendium, LazyCompendium):
+        use_lazy_compendium(*lazy_settings)
+    compendium.get_compendium()
@@ -0,0 +1,253 @@
+import argparse
+import heapq
+import json
+import sys
+import time
+from typing import *
+from utils import *
+from ship_configuration import *
+from compatibility import CompatibilityMatrix
+from compendium import Compendium
+import compendium
+
+MOUNT = "mount"
+BAY = "bay"
+SYSTEM = "system"
+
+class Objective():
+    # Scores are additive over the equipped items, which is what makes the search bound valid.
+    def score_weapon(self, mount: Mount, weapon: Weapon) -> float:
+        return 0
+
+    def score_craft(self, bay: Bay, craft: Craft) -> float:
+        return 0
+
+    def score_system(self, ship: Ship, system: ShipSystem) -> float:
+        return 0
+
+class ExpectedDamage(Objective):
+    def score_weapon(self, mount: Mount, weapon: Weapon) -> float:
+        return weapon.get_damage_dice().mean() * weapon.get_shots_dice().mean() * mount._count
+
+    def score_craft(self, bay: Bay, craft: Craft) -> float:
+        return craft.get_damage_dice().mean() * craft.get_swarm_dice().mean() * get_bay_count(bay, craft)
+
+def get_bay_count(bay: Bay, craft: Craft) -> int:
+    return 1 if "Highlander" in craft.get_tags() else bay._count
+
+class Option():
+    def __init__(self, item, score: float=0, power: int=0, ammo: int=0, slots: int=0):
+        self._item = item
+        self._score = score
+        self._power = power
+        self._ammo = ammo
+        self._slots = slots
+
+class Decision():
+    def __init__(self, kind: str, index: int, signature: tuple, options: List[Option]):
+        self._kind = kind
+        self._index = index
+        self._signature = signature
+        self._options = options
+
+class OptimizationResult():
+    def __init__(self, loadouts: List[Loadout], nodes: int, elapsed: float, complete: bool):
+        self._loadouts = loadouts
+        self._nodes = nodes
+        self._elapsed = elapsed
+        self._complete = complete
+
+    def get_best(self) -> Loadout:
+        return self._loadouts[0] if self._loadouts else None
+
+def get_mount_signature(mount: Mount) -> tuple:
+    return (MOUNT, mount._size, mount._count, mount._type, mount._position, mount._is_spinal_only, mount._equip_restrictions)
+
+def get_bay_signature(bay: Bay) -> tuple:
+    return (BAY, bay._size, bay._count, tuple(bay._positions), bay._equip_restrictions)
+
+def remove_dominated(options: List[Option]) -> List[Option]:
+    # an option no better and no cheaper than another one can never be part of the single best loadout
+    kept = []
+    for option in options:
+        if not any(other is not option and other._score >= option._score and other._power <= option._power
+                and other._ammo <= option._ammo and other._slots <= option._slots
+                and (other._score, -other._power, -other._ammo, -other._slots) != (option._score, -option._power, -option._ammo, -option._slots)
+                for other in options):
+            kept.append(option)
+    return kept
+
+def build_decisions(template: Ship, objective: Objective, weapons: List[Weapon], crafts: List[Craft], systems: List[ShipSystem], prune_dominated: bool=False,
+        compatibility: CompatibilityMatrix=None) -> List[Decision]:
+    compatibility = compatibility or CompatibilityMatrix(weapons, crafts)
+    decisions = []
+    for index, mount in enumerate(template._mounts):
+        options = [Option(None)] + [
+            Option(weapon, objective.score_weapon(mount, weapon), *mount.get_draw(weapon))
+            for weapon in compatibility.filter_weapons(mount, weapons)
+        ]
+        decisions.append(Decision(MOUNT, index, get_mount_signature(mount), options))
+    for index, bay in enumerate(template._bays):
+        options = [Option(None)] + [
+            Option(craft, objective.score_craft(bay, craft), *bay.get_draw(craft))
+            for craft in compatibility.filter_crafts(bay, crafts)
+        ]
+        decisions.append(Decision(BAY, index, get_bay_signature(bay), options))
+    for index, system in enumerate(systems):
+        if template.has_system(system) or (system._ship_classes and template._class not in system._ship_classes):
+            continue
+        score = objective.score_system(template, system)
+        if score <= 0:
+            # cannot improve the objective, so only the choice of weapons and crafts is searched
+            continue
+        options = [Option(None), Option(system, score, slots=system._slots)]
+        decisions.append(Decision(SYSTEM, index, (SYSTEM, index), options))
+    for decision in decisions:
+        if prune_dominated:
+            decision._options = remove_dominated(decision._options)
+        decision._options.sort(key=lambda option: -option._score)
+    # identical mounts and bays next to each other, so that symmetric assignments can be skipped
+    decisions.sort(key=lambda decision: (decision._kind == SYSTEM, repr(decision._signature)))
+    return decisions
+
+def get_increments(options: List[Option], get_cost: Callable[[Option], int]) -> Tuple[float, List[Tuple[float, int, float]]]:
+    # upper concave hull of (cost, score): the LP relaxation of picking one option
+    base = max(option._score for option in options if get_cost(option) == 0)
+    points = sorted((get_cost(option), option._score) for option in options if get_cost(option) > 0 and option._score > base)
+    hull = [(0, base)]
+    for cost, score in points:
+        if score <= hull[-1][1]:
+            continue
+        while len(hull) >= 2 and (hull[-1][1] - hull[-2][1]) * (cost - hull[-1][0]) <= (score - hull[-1][1]) * (hull[-1][0] - hull[-2][0]):
+            hull.pop()
+        hull.append((cost, score))
+    increments = [((score - previous_score) / (cost - previous_cost), cost - previous_cost, score - previous_score)
+        for (previous_cost, previous_score), (cost, score) in zip(hull, hull[1:])]
+    return base, increments
+
+class BudgetBound():
+    # Bounds the score of the remaining decisions under a single budget, e.g. power.
+    def __init__(self, decisions: List[Decision], get_cost: Callable[[Option], int]):
+        self._bases = [0.0] * (len(decisions) + 1)
+        self._increments = [[] for depth in range(len(decisions) + 1)]
+        for depth in range(len(decisions) - 1, -1, -1):
+            base, increments = get_increments(decisions[depth]._options, get_cost)
+            self._bases[depth] = self._bases[depth + 1] + base
+            self._increments[depth] = sorted(self._increments[depth + 1] + increments, reverse=True)
+
+    def get_bound(self, depth: int, budget: int) -> float:
+        bound = self._bases[depth]
+        for efficiency, cost, score in self._increments[depth]:
+            if cost <= budget:
+                bound += score
+                budget -= cost
+            else:
+                return bound + efficiency * budget
+        return bound
+
+def make_loadout(template: Ship, decisions: List[Decision], choices: Tuple[int, ...], score: float) -> Loadout:
+    weapons = [None] * len(template._mounts)
+    crafts = [None] * len(template._bays)
+    systems = []
+    for decision, choice in zip(decisions, choices):
+        item = decision._options[choice]._item
+        if decision._kind == MOUNT:
+            weapons[decision._index] = item
+        elif decision._kind == BAY:
+            crafts[decision._index] = item
+        elif item:
+            systems.append(item)
+    return Loadout(template._name, weapons, crafts, systems, score)
+
+def optimize_loadout(template: Ship, comp: Compendium, objective: Objective=None, power_budget: int=None, ammo_budget: int=None,
+        weapons: List[Weapon]=None, crafts: List[Craft]=None, systems: List[ShipSystem]=None,
+        top_k: int=1, max_nodes: int=None, time_limit: float=None) -> OptimizationResult:
+    objective = objective or ExpectedDamage()
+    weapons = comp.get_weapons() if weapons is None else weapons
+    crafts = comp.get_crafts() if crafts is None else crafts
+    systems = comp.get_slot_systems() if systems is None else systems
+    decisions = build_decisions(template, objective, weapons, crafts, systems, prune_dominated=top_k == 1, compatibility=comp._compatibility)
+    free_slots = template.get_free_system_slots()
+    # best possible score of the remaining decisions, ignoring every budget
+    bounds = [0.0] * (len(decisions) + 1)
+    for depth in range(len(decisions) - 1, -1, -1):
+        bounds[depth] = bounds[depth + 1] + max(option._score for option in decisions[depth]._options)
+    power_bound = BudgetBound(decisions, lambda option: option._power) if power_budget is not None else None
+    ammo_bound = BudgetBound(decisions, lambda option: option._ammo) if ammo_budget is not None else None
+    best = []
+    choices = []
+    nodes = 0
+    start_time = time.perf_counter()
+    stopped = False
+
+    def search(depth: int, score: float, power: int, ammo: int, slots: int):
+        nonlocal nodes, stopped
+        nodes += 1
+        if (max_nodes is not None and nodes > max_nodes) or (time_limit is not None and nodes % 1024 == 0 and time.perf_counter() - start_time > time_limit):
+            stopped = True
+        if stopped:
+            return
+        if len(best) == top_k:
+            threshold = best[0][0] - score
+            if (bounds[depth] <= threshold
+                    or (power_bound and power_bound.get_bound(depth, power_budget - power) <= threshold)
+                    or (ammo_bound and ammo_bound.get_bound(depth, ammo_budget - ammo) <= threshold)):
+                return
+        if depth == len(decisions):
+            entry = (score, nodes, tuple(choices))
+            if len(best) < top_k:
+                heapq.heappush(best, entry)
+            else:
+                heapq.heapreplace(best, entry)
+            return
+        decision = decisions[depth]
+        first_choice = 0
+        if depth > 0 and decisions[depth - 1]._signature == decision._signature:
+            # interchangeable with the previous decision, only keep one ordering of their choices
+            first_choice = choices[-1]
+        for choice in range(first_choice, len(decision._options)):
+            option = decision._options[choice]
+            if power_budget is not None and power + option._power > power_budget:
+                continue
+            if ammo_budget is not None and ammo + option._ammo > ammo_budget:
+                continue
+            if slots + option._slots > free_slots:
+                continue
+            choices.append(choice)
+            search(depth + 1, score + option._score, power + option._power, ammo + option._ammo, slots + option._slots)
+            choices.pop()
+            if stopped:
+                return
+
+    search(0, 0.0, 0, 0, 0)
+    loadouts = [make_loadout(template, decisions, entry[2], entry[0]) for entry in sorted(best, key=lambda entry: (-entry[0], entry[1]))]
+    return OptimizationResult(loadouts, nodes, time.perf_counter() - start_time, not stopped)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--ship", required=True, help="The name of the ship to optimize. Ex: Emblem")
+    parser.add_argument("-w", "--weapons", nargs="*", help="Only consider these weapons. Defaults to every weapon in the compendium.")
+    parser.add_argument("-c", "--crafts", nargs="*", help="Only consider these crafts. Defaults to every craft in the compendium.")
+    parser.add_argument("--power", type=int, default=None, help="Power budget for firing every mount and launching every bay once.")
+    parser.add_argument("--ammo", type=int, default=None, help="Ammo budget for firing every mount and launching every bay once.")
+    parser.add_argument("-k", "--top", type=int, default=1, help="Number of best loadouts to return.")
+    parser.add_argument("--max-nodes", type=int, default=None, help="Stop searching after this many nodes and return the best loadouts found so far.")
+    parser.add_argument("--time-limit", type=float, default=None, help="Stop searching after this many seconds and return the best loadouts found so far.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    comp = compendium.get_compendium()
+    template = comp.get_ship(args.ship)
+    if template is None:
+        raise ValueError(f"Ship {args.ship} does not exist in the compendium")
+    weapons = [comp.get_weapon(name) for name in args.weapons] if args.weapons else None
+    crafts = [comp.get_craft(name) for name in args.crafts] if args.crafts else None
+    if (weapons and None in weapons) or (crafts and None in crafts):
+        raise ValueError("Some of the given weapons or crafts do not exist in the compendium")
+    result = optimize_loadout(template, comp, power_budget=args.power, ammo_budget=args.ammo, weapons=weapons, crafts=crafts,
+        top_k=args.top, max_nodes=args.max_nodes, time_limit=args.time_limit)
+    for loadout in result._loadouts:
+        print(json.dumps(loadout.to_json()))
+    status = "complete" if result._complete else "stopped early"
+    print(f"Searched {result._nodes} nodes in {result._elapsed:.2f}s ({status})", file=sys.stderr)
@@ -1,7 +1,86 @@
-from fpdf import FPDF
+from fpdf import FPDF, FPDF_VERSION
+from fpdf.ttfonts import TTFontFile
+from typing import BinaryIO
 from ship_configuration import *
-from utils import multiply_dice
-from compendium import *
+import fpdf
+import os
+import pickle
+import profiling
+import types
+
+FONT_CACHE_VERSION = 1
+# the font cache and subset cache rely on the internals of this fpdf version
+SUPPORTED_FPDF_VERSION = "1.7.2"
+PRINTABLE_ASCII = list(range(32, 127))
+
+def get_file_signature(path: str) -> tuple:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+def get_font_path(file_name: str) -> str:
+    # the same lookup as fpdf's add_font
+    for font_dir in ["", fpdf.fpdf.FPDF_FONT_DIR, fpdf.fpdf.SYSTEM_TTFONTS]:
+        path = os.path.join(font_dir, file_name) if font_dir else file_name
+        if os.path.exists(path):
+            return path
+    return file_name
+
+def get_font_cache_path() -> str:
+    return os.path.join(get_cache_dir(), f"fonts-{FONT_CACHE_VERSION}-fpdf{FPDF_VERSION}.pickle")
+
+def load_font_cache() -> dict:
+    try:
+        with open(get_font_cache_path(), "rb") as cache_file:
+            return pickle.load(cache_file)
+    except Exception:
+        # a missing or unreadable cache is simply rebuilt
+        return {}
+
+def save_font_cache(font_metrics: dict):
+    cache_path = get_font_cache_path()
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as cache_file:
+            pickle.dump(font_metrics, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+def parse_font_metrics(family: str, style: str, font_path: str) -> Tuple[dict, dict]:
+    # fpdf would write its own .pkl next to the font file, which may not be writable
+    cache_mode = fpdf.fpdf.FPDF_CACHE_MODE
+    fpdf.set_global("FPDF_CACHE_MODE", 1)
+    try:
+        parser = FPDF()
+        parser.add_font(family, style, font_path, uni=True)
+    finally:
+        fpdf.set_global("FPDF_CACHE_MODE", cache_mode)
+    font_key = family.lower() + style
+    return parser.fonts[font_key], parser.font_files[font_key]
+
+class CachedTTFontFile(TTFontFile):
+    # fpdf parses the whole font file again for every subset it embeds, identical subsets are reused instead
+    SUBSET_CACHE_SIZE = 64
+    _subsets = LRUCache(SUBSET_CACHE_SIZE)
+
+    def makeSubset(self, file, subset):
+        # the subset font only depends on which characters are in it, fpdf appends every character it draws
+        key = (file, get_file_signature(file), frozenset(subset))
+        cached = CachedTTFontFile._subsets.get(key)
+        if cached is None:
+            font_stream = super().makeSubset(file, subset)
+            cached = (font_stream, self.codeToGlyph, self.maxUni)
+            CachedTTFontFile._subsets.put(key, cached)
+        font_stream, self.codeToGlyph, self.maxUni = cached
+        return font_stream
+
+def with_cached_subsets(method: Callable) -> Callable:
+    # fpdf looks TTFontFile up in its module, this copy of the method finds the cached class there instead, without changing fpdf itself
+    return types.FunctionType(method.__code__, dict(vars(fpdf.fpdf), TTFontFile=CachedTTFontFile), method.__name__, method.__defaults__, method.__closure__)
 
 class ShipSheet(FPDF):
 
@@ -17,6 +96,15 @@ class ShipSheet(FPDF):
     TRAIT_TABLE_HEADINGS = [
         "NAME", "DESCRIPTION"
     ]
+    FLEET_POINTS_HEADINGS = [
+        "POINTS USED", "POINTS FREE", "MAX POINTS"
+    ]
+    FLEET_CLASS_HEADINGS = [
+        "CLASS", "SHIPS"
+    ]
+    FLEET_SHIP_HEADINGS = [
+        "SHIP NAME", "CLASS", "POINTS"
+    ]
     DAMAGE_BUBBLE = "[_]"
     FANCY_FONT_PRESETS = {
         "Heading 2": {
@@ -72,30 +160,107 @@ class ShipSheet(FPDF):
         },
     }
 
-    def __init__(self, orientation = 'P', unit = 'mm', format='A4', use_base_fonts: bool=True):
+    FANCY_FONT_FILES = [
+        ("DejaVu", "", "DejaVuSansCondensed.ttf"),
+        ("DejaVu", "B", "DejaVuSansCondensed-Bold.ttf"),
+        ("DejaVu Mono", "", "DejaVuSansMono.ttf"),
+        ("DejaVu Mono", "B", "DejaVuSansMono-Bold.ttf"),
+        ("DejaVu Condensed", "", "DejaVuSansCondensed.ttf"),
+        ("DejaVu Condensed", "B", "DejaVuSansCondensed-Bold.ttf"),
+    ]
+    # parsed TTF metrics by font file, loaded from the user cache directory by the first sheet of the process
+    _font_metrics = None
+    LAYOUT_CACHE_SIZE = 4096
+    # string widths keyed on (font, unit scale, text), shared by every sheet created in this process
+    _layout_cache = LRUCache(LAYOUT_CACHE_SIZE)
+    _heading_widths = {}
+    SKELETON_CACHE_SIZE = 256
+    # pre-rendered static page content per hull, shared by every sheet created in this process
+    _skeleton_cache = LRUCache(SKELETON_CACHE_SIZE)
+
+    if FPDF_VERSION == SUPPORTED_FPDF_VERSION:
+        _putfonts = with_cached_subsets(FPDF._putfonts)
+
+    def __init__(self, orientation = 'P', unit = 'mm', format='A4', use_base_fonts: bool=True, cache_skeletons: bool=True, pad_subsets: bool=False):
         super().__init__(orientation, unit, format)
+        self._cache_skeletons = cache_skeletons
+        self._pad_subsets = pad_subsets
         self._font_presets = self.BASE_FONT_PRESETS if use_base_fonts else self.FANCY_FONT_PRESETS
         if not use_base_fonts:
             self.import_fonts()
+        self.load_preset_fonts()
 
     def import_fonts(self):
-        self.add_font("DejaVu", "", "DejaVuSansCondensed.ttf", uni=True)
-        self.add_font("DejaVu", "B", "DejaVuSansCondensed-Bold.ttf", uni=True)
-        self.add_font("DejaVu Mono", "", "DejaVuSansMono.ttf", uni=True)
-        self.add_font("DejaVu Mono", "B", "DejaVuSansMono-Bold.ttf", uni=True)
-        self.add_font("DejaVu Condensed", "", "DejaVuSansCondensed.ttf", uni=True)
-        self.add_font("DejaVu Condensed", "B", "DejaVuSansCondensed-Bold.ttf", uni=True)
+        if FPDF_VERSION != SUPPORTED_FPDF_VERSION:
+            raise RuntimeError(f"Fancy fonts need fpdf {SUPPORTED_FPDF_VERSION}, but fpdf {FPDF_VERSION} is installed")
+        if ShipSheet._font_metrics is None:
+            ShipSheet._font_metrics = load_font_cache()
+        parsed = False
+        for family, style, file_name in ShipSheet.FANCY_FONT_FILES:
+            font_key = family.lower() + style
+            if font_key in self.fonts:
+                continue
+            font_path = get_font_path(file_name)
+            signature = get_file_signature(font_path)
+            cached = ShipSheet._font_metrics.get(font_path)
+            if cached is None or cached[0] != signature:
+                cached = (signature, *parse_font_metrics(family, style, font_path))
+                ShipSheet._font_metrics[font_path] = cached
+                parsed = True
+            # same entries as add_font would create, without reading the metrics again
+            signature, font, font_file = cached
+            subset = list(range(0, 57)) if hasattr(self, 'str_alias_nb_pages') else list(range(0, 32))
+            self.fonts[font_key] = dict(font, i=len(self.fonts) + 1, fontkey=font_key, subset=subset, initial_subset_size=len(subset))
+            self.font_files[font_key] = dict(font_file)
+            self.font_files[file_name] = {'type': "TTF"}
+        if parsed:
+            save_font_cache(ShipSheet._font_metrics)
+
+    def load_preset_fonts(self):
+        # loads every preset font up front, so that strings can be measured without switching fonts
+        for preset in self._font_presets.values():
+            self.set_font(*preset["font"])
+        self.font_family = ''
+
+    def get_font_key(self, family: str, style: str) -> str:
+        family = family.lower()
+        return ("helvetica" if family == "arial" else family) + style.upper()
+
+    def get_preset_string_width(self, preset_name: str, text: str) -> float:
+        font = self._font_presets[preset_name]["font"]
+        key = (font, self.k, text)
+        width = ShipSheet._layout_cache.get(key)
+        if width is None:
+            width = self.measure_string(font, text)
+            ShipSheet._layout_cache.put(key, width)
+        return width
+
+    def measure_string(self, font: Tuple[str, str, int], text: str) -> float:
+        family, style, size = font
+        font_metrics = self.fonts[self.get_font_key(family, style)]
+        char_widths = font_metrics['cw']
+        if font_metrics['type'] == 'TTF':
+            missing_width = font_metrics['desc']['MissingWidth'] or 500
+            width = sum(char_widths[ord(char)] if len(char_widths) > ord(char) else missing_width for char in text)
+        else:
+            width = sum(char_widths.get(char, 0) for char in text)
+        return width * size / self.k / 1000.0
+
+    def get_heading_widths(self, headings: List[str], preset_name: str) -> List[float]:
+        key = (tuple(headings), self._font_presets[preset_name]["font"], self.k)
+        if key not in ShipSheet._heading_widths:
+            ShipSheet._heading_widths[key] = [self.get_preset_string_width(preset_name, heading) + ShipSheet.TABLE_COLUMN_SPACING for heading in headings]
+        return list(ShipSheet._heading_widths[key])
 
     def set_font_from_preset(self, preset_name: str):
         self.set_font(*self._font_presets.get(preset_name).get("font"))
         self.set_text_color(*self._font_presets.get(preset_name).get("color"))
 
+    @profiling.traced("ShipSheet.create_mount_table")
     def create_mount_table(self, mounts: List[Mount]):
-        self.set_font_from_preset("Mono Heading 3")
-        cell_widths = [self.get_string_width(heading) + ShipSheet.TABLE_COLUMN_SPACING for heading in ShipSheet.MOUNT_TABLE_HEADINGS]
-        self.set_font_from_preset("Mono")
-        weapon_name_widths = [(self.get_string_width(f"{self.DAMAGE_BUBBLE} {mount._weapon._name}") + ShipSheet.TABLE_COLUMN_SPACING) if mount._weapon else 0 for mount in mounts]
-        cell_widths[0] = max(cell_widths[0], *weapon_name_widths)
+        cell_widths = self.get_heading_widths(ShipSheet.MOUNT_TABLE_HEADINGS, "Mono Heading 3")
+        weapon_name_widths = [(self.get_preset_string_width("Mono", f"{self.DAMAGE_BUBBLE} {mount._weapon._name}") + ShipSheet.TABLE_COLUMN_SPACING) if mount._weapon else 0 for mount in mounts]
+        cell_widths[0] = max([cell_widths[0], *weapon_name_widths])
         cell_widths[-1] = 0 # last cell takes all the remaining space
         
         self.set_font_from_preset("Mono Heading 3")
@@ -105,12 +270,11 @@ class ShipSheet(FPDF):
             mount_data = self.get_mount_display_data(mount)
             self.create_row(mount_data, cell_widths)
     
+    @profiling.traced("ShipSheet.create_bay_table")
     def create_bay_table(self, bays: List[Bay]):
-        self.set_font_from_preset("Mono Heading 3")
-        cell_widths = [self.get_string_width(heading) + ShipSheet.TABLE_COLUMN_SPACING for heading in ShipSheet.BAY_TABLE_HEADINGS]
-        self.set_font_from_preset("Mono")
-        weapon_name_widths = [(self.get_string_width(f"{self.DAMAGE_BUBBLE} {bay._craft._name}") + ShipSheet.TABLE_COLUMN_SPACING) if bay._craft else 0 for bay in bays]
-        cell_widths[0] = max(cell_widths[0], *weapon_name_widths)
+        cell_widths = self.get_heading_widths(ShipSheet.BAY_TABLE_HEADINGS, "Mono Heading 3")
+        weapon_name_widths = [(self.get_preset_string_width("Mono", f"{self.DAMAGE_BUBBLE} {bay._craft._name}") + ShipSheet.TABLE_COLUMN_SPACING) if bay._craft else 0 for bay in bays]
+        cell_widths[0] = max([cell_widths[0], *weapon_name_widths])
         cell_widths[-1] = 0 # last cell takes all the remaining space
 
         self.set_font_from_preset("Mono Heading 3")
@@ -139,7 +303,7 @@ class ShipSheet(FPDF):
         weapon = mount._weapon
         mount_data = [str(datum) for datum in [
             f"{self.DAMAGE_BUBBLE} {weapon._name}", mount_position_data, weapon._range, weapon._ammo_cost, weapon._power_cost,
-            multiply_dice(weapon.get_shots(), mount._count), weapon._ap, weapon._damage, ', '.join(weapon._tags)
+            weapon.get_shots_dice() * mount._count, weapon._ap, weapon._damage, ', '.join(weapon._tags)
         ]]
         return mount_data
     
@@ -172,6 +336,7 @@ class ShipSheet(FPDF):
             self.cell(int(width), HEIGHT, datum, border='T' if system else 'TB', ln=0, align='L')
         return HEIGHT
     
+    @profiling.traced("ShipSheet.create_system_table")
     def create_system_table(self, systems: List[ShipSystem], heading: str, start_x: float, end_x: float):
         self.set_font_from_preset("Heading 2")
         self.set_x(start_x)
@@ -194,6 +359,7 @@ class ShipSheet(FPDF):
             stat_box_align = 'C'
         self.cell(stat_box_width, height, stat_box_text, border=1, ln=1, align=stat_box_align)
 
+    @profiling.traced("ShipSheet.show_stats")
     def show_stats(self, ship: Ship, start_x: int, end_x: int):
         STAT_COLUMNS = [
             [ShipStat.HP, ShipStat.SHIELDS, ShipStat.POWER, ShipStat.AMMO, ShipStat.RESTORES],
@@ -216,15 +382,16 @@ class ShipSheet(FPDF):
             self.set_x(start_x)
             self.show_stat(ship, stat, end_x - start_x, STAT_HEIGHT, stat.is_gauge())
         
+    @profiling.traced("ShipSheet.show_traits")
     def show_traits(self, ship: Ship):
         traits = ship._traits
         if not traits:
             return
         self.set_font_from_preset("Heading 2")
         self.cell(0, 8, "TRAITS", border=0, ln=1, align="L")
+        trait_name_widths = [(self.get_preset_string_width("Mono Heading 3", trait_name) + ShipSheet.TABLE_COLUMN_SPACING) for trait_name in traits.keys()]
+        cell_widths = [max(self.get_heading_widths(ShipSheet.TRAIT_TABLE_HEADINGS, "Mono Heading 3")[0], *trait_name_widths), 0]
         self.set_font_from_preset("Mono Heading 3")
-        trait_name_widths = [(self.get_string_width(trait_name) + ShipSheet.TABLE_COLUMN_SPACING) for trait_name in traits.keys()]
-        cell_widths = [max(self.get_string_width(ShipSheet.TRAIT_TABLE_HEADINGS[0]) + ShipSheet.TABLE_COLUMN_SPACING, *trait_name_widths), 0]
         self.create_row(ShipSheet.TRAIT_TABLE_HEADINGS, cell_widths)
         self.set_font_from_preset("Mono")
         for trait_name, trait_description in traits.items():
@@ -234,8 +401,27 @@ class ShipSheet(FPDF):
         pass
     
     def create_sheet(self, ship: Ship, output_path: str):
-        self.alias_nb_pages()
-        self.add_page()
+        self.draw_sheet(ship)
+        self.output(output_path, 'F')
+
+    def create_fleet_sheet(self, army: Army, output_path: str):
+        self.draw_fleet(army)
+        self.output(output_path, 'F')
+
+    def draw_fleet(self, army: Army):
+        self.show_fleet_summary(army)
+        for ship in army._ships:
+            self.draw_sheet(ship)
+
+    def draw_sheet_skeleton(self, ship: Ship) -> Tuple[float, float]:
+        # everything above the slot systems is the same for every loadout of a hull
+        key = self.get_skeleton_key(ship) if self._cache_skeletons else None
+        skeleton = ShipSheet._skeleton_cache.get(key) if key else None
+        if skeleton and skeleton["template"] is getattr(ship, "_template", ship):
+            return self.replay_skeleton(skeleton)
+        page = self.page
+        content_start = len(self.pages[page])
+        subset_starts = {font_key: len(font['subset']) for font_key, font in self.fonts.items() if font['type'] == 'TTF'}
         self.set_font_from_preset("Heading 2")
         self.cell(0, 8, f"{ship._name}", border=0, ln=1, align='C')
         self.set_font_from_preset("Paragraph")
@@ -244,6 +430,107 @@ class ShipSheet(FPDF):
         systems_y = self.get_y()
         self.create_system_table([system for system in ship._systems if system._slots == 0], "SYSTEMS - CORE", self.l_margin, (self.w / 2) - 5)
         core_systems_end_y = self.get_y()
+        if key and self.page == page:
+            ShipSheet._skeleton_cache.put(key, {
+                "template": getattr(ship, "_template", ship),
+                "content": self.pages[page][content_start:],
+                "subsets": {font_key: self.fonts[font_key]['subset'][start:] for font_key, start in subset_starts.items()},
+                "systems_y": systems_y,
+                "core_systems_end_y": core_systems_end_y
+            })
+        return systems_y, core_systems_end_y
+
+    @staticmethod
+    def invalidate_skeletons(system_names: Set[str]=None):
+        # skeletons of replaced hulls never match again, only edited core systems leave stale skeletons behind
+        if system_names is None:
+            ShipSheet._skeleton_cache.clear()
+        else:
+            ShipSheet._skeleton_cache.remove_if(lambda key, skeleton: not system_names.isdisjoint(key[1]))
+
+    def get_skeleton_key(self, ship: Ship) -> tuple:
+        template = getattr(ship, "_template", ship)
+        core_systems = tuple(system._name for system in ship._systems if system._slots == 0)
+        # font numbers are baked into the content, so the loaded fonts must match exactly
+        return (id(template), core_systems, tuple(self.fonts.keys()), self.w, self.h, self.k, self.l_margin, self.r_margin, self.t_margin)
+
+    @profiling.traced("ShipSheet.replay_skeleton")
+    def replay_skeleton(self, skeleton: dict) -> Tuple[float, float]:
+        self.pages[self.page] += skeleton["content"]
+        for font_key, characters in skeleton["subsets"].items():
+            self.fonts[font_key]['subset'].extend(characters)
+        # the replayed content changed fonts behind fpdf's back, force the next font to be written
+        self.font_family = ''
+        self.set_y(skeleton["core_systems_end_y"])
+        return skeleton["systems_y"], skeleton["core_systems_end_y"]
+
+    def show_fleet_summary(self, army: Army):
+        self.alias_nb_pages()
+        self.add_page()
+        self.set_font_from_preset("Heading 2")
+        self.cell(0, 8, "FLEET", border=0, ln=1, align='C')
+        self.create_fleet_table(ShipSheet.FLEET_POINTS_HEADINGS, [
+            [str(army.get_point_cost()), str(army.get_free_points()), str(army._max_points)]
+        ])
+        self.ln()
+        self.set_font_from_preset("Heading 2")
+        self.cell(0, 8, "SHIP CLASSES", border=0, ln=1, align='L')
+        self.create_fleet_table(ShipSheet.FLEET_CLASS_HEADINGS, [
+            [ship_class.name, str(count)] for ship_class, count in army.get_class_counts().items()
+        ])
+        self.ln()
+        self.set_font_from_preset("Heading 2")
+        self.cell(0, 8, "SHIPS", border=0, ln=1, align='L')
+        self.create_fleet_table(ShipSheet.FLEET_SHIP_HEADINGS, [
+            [ship._name, ship._class.name, str(ship._point_cost)] for ship in army._ships
+        ])
+
+    def create_fleet_table(self, headings: List[str], rows: List[List[str]]):
+        cell_widths = self.get_heading_widths(headings, "Mono Heading 3")
+        for row in rows:
+            cell_widths = [max(width, self.get_preset_string_width("Mono", datum) + ShipSheet.TABLE_COLUMN_SPACING) for width, datum in zip(cell_widths, row)]
+        cell_widths[-1] = 0 # last cell takes all the remaining space
+
+        self.set_font_from_preset("Mono Heading 3")
+        self.create_row(headings, cell_widths)
+        self.set_font_from_preset("Mono")
+        for row in rows:
+            self.create_row(row, cell_widths)
+
+    def create_sheet_bytes(self, ship: Ship) -> bytes:
+        self.draw_sheet(ship)
+        return self.get_pdf_bytes()
+
+    def write_sheet(self, ship: Ship, stream: BinaryIO):
+        self.draw_sheet(ship)
+        self.write_pdf(stream)
+
+    @profiling.traced("ShipSheet.output")
+    def output(self, name: str='', dest: str=''):
+        # with padding, fonts that were used embed all of printable ASCII, so that most sheets have the same subsets and reuse them
+        # this makes every sheet larger, and only pays off in processes that render many sheets
+        if self._pad_subsets:
+            for font in self.fonts.values():
+                if font['type'] == 'TTF' and len(font['subset']) > font.get('initial_subset_size', 0):
+                    font['subset'].extend(PRINTABLE_ASCII)
+        return super().output(name, dest)
+
+    def get_pdf_bytes(self) -> bytes:
+        # fpdf keeps the document as a latin-1 str, this is the only copy made
+        return self.output(dest='S').encode("latin1")
+
+    def write_pdf(self, stream: BinaryIO):
+        data = memoryview(self.get_pdf_bytes())
+        if hasattr(stream, "sendall"):
+            stream.sendall(data)
+        else:
+            stream.write(data)
+
+    @profiling.traced("ShipSheet.draw_sheet")
+    def draw_sheet(self, ship: Ship):
+        self.alias_nb_pages()
+        self.add_page()
+        systems_y, core_systems_end_y = self.draw_sheet_skeleton(ship)
         self.set_y(systems_y)
         self.create_system_table([system for system in ship._systems if system._slots > 0] + [None] * ship.get_free_system_slots(), "SYSTEMS - SLOTS", (self.w / 2), self.w - self.r_margin)
         slot_systems_end_y = self.get_y()
@@ -256,7 +543,6 @@ class ShipSheet(FPDF):
         self.cell(0, 8, "BAYS", border=0, ln=1, align='L')
         self.set_font_from_preset("Paragraph")
         self.create_bay_table(ship._bays)
-        self.output(output_path, 'F')
 
 
 # VERY_LONG_STRING = "A test weapon. This is about as long as a description will ever be, but I need to make sure that text wraps around correctly, just in case. "
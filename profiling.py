@@ -0,0 +1,142 @@
+import functools
+import json
+import os
+import threading
+import time
+from typing import *
+
+FLAT = "flat"
+CHROME = "chrome"
+
+class Span():
+    __slots__ = ("_name", "_start_ns", "_duration_ns", "_thread_id", "_args")
+
+    def __init__(self, name: str, start_ns: int, duration_ns: int, thread_id: int, args: dict):
+        self._name = name
+        self._start_ns = start_ns
+        self._duration_ns = duration_ns
+        self._thread_id = thread_id
+        self._args = args
+
+class Profiler():
+    # Records every finished span, and passes it on to the hooks.
+    def __init__(self):
+        self._spans = []
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._start_ns = time.perf_counter_ns()
+
+    def add_hook(self, hook: Callable[[Span], None]):
+        self._hooks.append(hook)
+
+    def record(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+        for hook in self._hooks:
+            hook(span)
+
+    def get_flat_report(self) -> List[dict]:
+        # one row per span name, slowest total first
+        rows = {}
+        for span in self._spans:
+            row = rows.setdefault(span._name, {"name": span._name, "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            row["count"] += 1
+            row["total_ms"] += span._duration_ns / 1e6
+            row["max_ms"] = max(row["max_ms"], span._duration_ns / 1e6)
+        for row in rows.values():
+            row["mean_ms"] = row["total_ms"] / row["count"]
+        return sorted(rows.values(), key=lambda row: row["total_ms"], reverse=True)
+
+    def format_flat_report(self) -> str:
+        lines = [f"{'span':<40} {'count':>8} {'total ms':>12} {'mean ms':>10} {'max ms':>10}"]
+        for row in self.get_flat_report():
+            lines.append(f"{row['name']:<40} {row['count']:>8} {row['total_ms']:>12.3f} {row['mean_ms']:>10.3f} {row['max_ms']:>10.3f}")
+        return "\n".join(lines)
+
+    def to_chrome_trace(self) -> dict:
+        # complete events of the trace event format, which chrome://tracing and Perfetto can open
+        pid = os.getpid()
+        return {"traceEvents": [{
+            "name": span._name,
+            "ph": "X",
+            "ts": (span._start_ns - self._start_ns) / 1000,
+            "dur": span._duration_ns / 1000,
+            "pid": pid,
+            "tid": span._thread_id,
+            "args": span._args,
+        } for span in self._spans], "displayTimeUnit": "ms"}
+
+    def write(self, output_path: str, output_format: str=CHROME):
+        with open(output_path, "w") as output_file:
+            if output_format == CHROME:
+                json.dump(self.to_chrome_trace(), output_file)
+            else:
+                output_file.write(self.format_flat_report() + "\n")
+
+class _SpanContext():
+    __slots__ = ("_profiler", "_name", "_args", "_start_ns")
+
+    def __init__(self, profiler: Profiler, name: str, args: dict):
+        self._profiler = profiler
+        self._name = name
+        self._args = args
+
+    def __enter__(self):
+        self._start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end_ns = time.perf_counter_ns()
+        self._profiler.record(Span(self._name, self._start_ns, end_ns - self._start_ns, threading.get_ident(), self._args))
+        return False
+
+class _NoSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_SPAN = _NoSpan()
+profiler = None
+
+def enable() -> Profiler:
+    global profiler
+    profiler = profiler or Profiler()
+    return profiler
+
+def disable() -> Profiler:
+    # returns the profiler that was recording, to report on it
+    global profiler
+    previous, profiler = profiler, None
+    return previous
+
+def get_profiler() -> Profiler:
+    return profiler
+
+def add_hook(hook: Callable[[Span], None]) -> Profiler:
+    # hooks see every span as it finishes, e.g. to forward timings elsewhere, and enable profiling
+    enabled = enable()
+    enabled.add_hook(hook)
+    return enabled
+
+def span(name: str, **args):
+    # Times a with block, and costs a single check while profiling is disabled.
+    if profiler is None:
+        return _NO_SPAN
+    return _SpanContext(profiler, name, args)
+
+def traced(name: str=None):
+    # Times every call of the decorated function as a span, named after the function by default.
+    def decorator(function: Callable) -> Callable:
+        span_name = name or function.__qualname__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if profiler is None:
+                return function(*args, **kwargs)
+            with _SpanContext(profiler, span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
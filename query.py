@@ -0,0 +1,130 @@
+import bisect
+from enum import Enum
+from typing import *
+from utils import *
+from ship_configuration import *
+
+RANGE = "range"
+EXACT = "exact"
+COLLECTION = "collection"
+
+RANGE_OPERATORS = ["lt", "lte", "gt", "gte"]
+EXACT_OPERATORS = ["exact", "in"]
+COLLECTION_OPERATORS = ["contains"]
+
+def _stat_fields(kind: str=RANGE) -> Dict[str, Tuple[Callable, str]]:
+    return {stat.name.lower(): ((lambda element, stat=stat: element.get_stat(stat)), kind) for stat in ShipStat}
+
+def _tag_keywords(tags: List[str]) -> Set[str]:
+    # "Shots 2d6" can be found both as "Shots 2d6" and as "Shots"
+    return set(tags) | {tag.split(" ")[0] for tag in tags}
+
+WEAPON_FIELDS = {
+    "name": (lambda weapon: weapon._name, EXACT),
+    "size": (lambda weapon: weapon._size, RANGE),
+    "range": (lambda weapon: weapon._range, RANGE),
+    "ammo": (lambda weapon: weapon._ammo_cost, RANGE),
+    "power": (lambda weapon: weapon._power_cost, RANGE),
+    "ap": (lambda weapon: weapon._ap, RANGE),
+    "damage": (lambda weapon: weapon._damage, EXACT),
+    "tags": (lambda weapon: _tag_keywords(weapon._tags), COLLECTION),
+}
+
+CRAFT_FIELDS = {
+    "name": (lambda craft: craft._name, EXACT),
+    "size": (lambda craft: craft.get_size(), RANGE),
+    "ammo": (lambda craft: craft.get_ammo(), RANGE),
+    "power": (lambda craft: craft.get_power(), RANGE),
+    "ap": (lambda craft: craft.get_ap(), RANGE),
+    "damage": (lambda craft: craft.get_damage(), EXACT),
+    "tags": (lambda craft: _tag_keywords(craft.get_tags()), COLLECTION),
+    **_stat_fields(),
+}
+
+SYSTEM_FIELDS = {
+    "name": (lambda system: system._name, EXACT),
+    "slots": (lambda system: system._slots, RANGE),
+    "hp": (lambda system: system._hp, RANGE),
+    "ship_classes": (lambda system: set(system._ship_classes), COLLECTION),
+}
+
+SHIP_FIELDS = {
+    "name": (lambda ship: ship._name, EXACT),
+    "ship_class": (lambda ship: ship._class, EXACT),
+    "points": (lambda ship: ship._point_cost, RANGE),
+    "system_slots": (lambda ship: ship._system_slots, RANGE),
+    "mounts": (lambda ship: len(ship._mounts), RANGE),
+    "bays": (lambda ship: len(ship._bays), RANGE),
+    "traits": (lambda ship: set(ship._traits.keys()), COLLECTION),
+    **_stat_fields(),
+}
+
+def _normalize(value):
+    # enum values may be given by name, as in the JSON files
+    if isinstance(value, Enum):
+        return value.name
+    return value
+
+class AttributeIndex():
+    def __init__(self, elements: list, getter: Callable, kind: str):
+        self._kind = kind
+        self._buckets = {}
+        self._keys = []
+        self._positions = []
+        if kind == COLLECTION:
+            for position, element in enumerate(elements):
+                for value in getter(element):
+                    self._buckets.setdefault(_normalize(value), set()).add(position)
+            return
+        pairs = [(_normalize(getter(element)), position) for position, element in enumerate(elements)]
+        pairs = [pair for pair in pairs if pair[0] is not None]
+        for value, position in pairs:
+            self._buckets.setdefault(value, set()).add(position)
+        if kind == RANGE:
+            pairs.sort(key=lambda pair: pair[0])
+            self._keys = [value for value, position in pairs]
+            self._positions = [position for value, position in pairs]
+
+    def lookup(self, operator: str, value) -> Set[int]:
+        if self._kind == COLLECTION:
+            if operator != "contains":
+                raise ValueError(f"Operator `{operator}` is not supported on collections, use one of {COLLECTION_OPERATORS}")
+            values = [value] if isinstance(value, (str, Enum)) else list(value)
+            matches = None
+            for item in values:
+                bucket = self._buckets.get(_normalize(item), set())
+                matches = bucket if matches is None else matches & bucket
+            return set(matches or ())
+        if operator == "exact":
+            return set(self._buckets.get(_normalize(value), ()))
+        if operator == "in":
+            return set().union(*(self._buckets.get(_normalize(item), set()) for item in value))
+        if self._kind != RANGE or operator not in RANGE_OPERATORS:
+            allowed = EXACT_OPERATORS + RANGE_OPERATORS if self._kind == RANGE else EXACT_OPERATORS
+            raise ValueError(f"Operator `{operator}` is not supported on this attribute, use one of {allowed}")
+        if operator == "lt":
+            return set(self._positions[:bisect.bisect_left(self._keys, value)])
+        if operator == "lte":
+            return set(self._positions[:bisect.bisect_right(self._keys, value)])
+        if operator == "gt":
+            return set(self._positions[bisect.bisect_right(self._keys, value):])
+        return set(self._positions[bisect.bisect_left(self._keys, value):])
+
+class QueryIndex():
+    def __init__(self, elements: list, fields: Dict[str, Tuple[Callable, str]]):
+        self._elements = elements
+        self._indexes = {name: AttributeIndex(elements, getter, kind) for name, (getter, kind) in fields.items()}
+
+    def query(self, element_type: type=object, **filters) -> list:
+        matches = None
+        for key, value in filters.items():
+            field, _, operator = key.partition("__")
+            if field not in self._indexes:
+                raise ValueError(f"Cannot query on `{field}`, expected one of: {', '.join(self._indexes.keys())}")
+            positions = self._indexes[field].lookup(operator or ("contains" if self._indexes[field]._kind == COLLECTION else "exact"), value)
+            matches = positions if matches is None else matches & positions
+            if not matches:
+                return []
+        if matches is None:
+            matches = range(len(self._elements))
+        return [self._elements[position] for position in sorted(matches) if isinstance(self._elements[position], element_type)]
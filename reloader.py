@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import traceback
+from typing import *
+from compendium import Compendium, CompendiumDiff, save_snapshot
+import compendium
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+_reload_lock = threading.Lock()
+# called with the new compendium and the diff after every reload that changed something
+_listeners = []
+
+def add_listener(listener: Callable[[Compendium, CompendiumDiff], None]):
+    _listeners.append(listener)
+
+def remove_listener(listener: Callable[[Compendium, CompendiumDiff], None]):
+    _listeners.remove(listener)
+
+def reload_file(path: str, update_snapshot: bool=True) -> CompendiumDiff:
+    # Re-parses one resource file and swaps the global compendium for the updated copy.
+    # Callers holding the previous compendium keep a consistent view of it.
+    with _reload_lock:
+        comp, diff = compendium.get_compendium().reload(path)
+        if diff.is_empty():
+            return diff
+        compendium.compendium = comp
+        if update_snapshot:
+            save_snapshot(comp)
+    for listener in list(_listeners):
+        listener(comp, diff)
+    return diff
+
+def get_watched_files() -> List[str]:
+    return [Compendium.WEAPON_LIST, Compendium.CRAFT_LIST, Compendium.SYSTEM_LIST, Compendium.SHIP_LIST]
+
+class CompendiumWatcher():
+    # Polls the resource files and reloads whichever changed, from a background thread.
+    def __init__(self, interval: float=DEFAULT_POLL_INTERVAL, paths: List[str]=None):
+        self._interval = interval
+        self._paths = paths or get_watched_files()
+        with _reload_lock:
+            compendium.get_compendium().track_changes()
+        self._signatures = {path: self.get_signature(path) for path in self._paths}
+        # files whose last edit could not be loaded, the snapshot must not claim they are up to date
+        self._failed_paths = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def get_signature(self, path: str) -> tuple:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # the file is being replaced, e.g. by an editor's atomic save
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def poll(self) -> List[CompendiumDiff]:
+        diffs = []
+        for path in self._paths:
+            signature = self.get_signature(path)
+            if signature is None or signature == self._signatures[path]:
+                continue
+            self._signatures[path] = signature
+            try:
+                diff = reload_file(path, update_snapshot=not self._failed_paths - {path})
+                self._failed_paths.discard(path)
+            except Exception:
+                self._failed_paths.add(path)
+                # a half-saved or invalid file keeps the previous compendium until it is saved again
+                print(f"Could not reload {path}, keeping the previous compendium:", file=sys.stderr)
+                traceback.print_exc()
+                continue
+            if not diff.is_empty():
+                diffs.append(diff)
+        return diffs
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            self.poll()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="compendium-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
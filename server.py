@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import *
+import compendium
+from pdf_convert import ShipSheet
+
+LOADOUT_KEYS = ["ship", "weapons", "crafts", "systems", "fancy"]
+MAX_REQUEST_SIZE = 64 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _invalidate_sheets(comp: compendium.Compendium, diff: compendium.CompendiumDiff):
+    if os.path.abspath(diff._path) == os.path.abspath(compendium.Compendium.SYSTEM_LIST):
+        ShipSheet.invalidate_skeletons(diff.get_names())
+
+def _warm_worker(watch_interval: float=None):
+    compendium.get_compendium()
+    if watch_interval:
+        # every worker process keeps its own compendium up to date
+        import reloader
+        reloader.add_listener(_invalidate_sheets)
+        reloader.CompendiumWatcher(watch_interval).start()
+    try:
+        ShipSheet(use_base_fonts=False)
+    except RuntimeError:
+        # fancy fonts are not installed, only base font sheets can be served
+        pass
+
+def render_sheet(loadout: dict) -> bytes:
+    comp = compendium.get_compendium()
+    ship = comp.create_ship(loadout["ship"], loadout.get("weapons"), loadout.get("crafts"), loadout.get("systems"))
+    # workers render sheet after sheet, and share font subsets between them
+    sheet = ShipSheet(use_base_fonts=not loadout.get("fancy", False), pad_subsets=True)
+    return sheet.create_sheet_bytes(ship)
+
+def parse_loadout(body: bytes) -> dict:
+    loadout = json.loads(body)
+    if not isinstance(loadout, dict) or not loadout.get("ship"):
+        raise ValueError("Request must be a JSON object with at least a `ship`")
+    unknown_keys = set(loadout.keys()) - set(LOADOUT_KEYS)
+    if unknown_keys:
+        raise ValueError(f"Unknown keys: {', '.join(sorted(unknown_keys))}")
+    return loadout
+
+class SheetRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        self.send_json(200, {"status": "ok", "max_concurrent": self.server._max_concurrent})
+
+    def do_POST(self):
+        if self.path != "/sheet":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            return self.send_json(400, {"error": "Content-Length must be an integer"})
+        if length <= 0 or length > MAX_REQUEST_SIZE:
+            return self.send_json(413 if length > 0 else 411, {"error": "Request body is missing or too large"})
+        try:
+            loadout = parse_loadout(self.rfile.read(length))
+        except ValueError as e:
+            return self.send_json(400, {"error": str(e)})
+        if not self.server._slots.acquire(timeout=self.server._queue_timeout):
+            return self.send_json(503, {"error": "Too many concurrent sheet requests, try again later"})
+        try:
+            future = self.server._executor.submit(render_sheet, loadout)
+        except Exception as e:
+            self.server._slots.release()
+            return self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+        # a render that timed out keeps its worker busy, so the slot is only freed once the worker is done
+        future.add_done_callback(lambda future: self.server._slots.release())
+        try:
+            pdf = future.result(timeout=self.server._render_timeout)
+        except ValueError as e:
+            return self.send_json(400, {"error": str(e)})
+        except TimeoutError:
+            # only frees the slot right away if the render has not started yet
+            future.cancel()
+            return self.send_json(504, {"error": "Sheet rendering timed out"})
+        except Exception as e:
+            return self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(pdf)))
+        self.end_headers()
+        view = memoryview(pdf)
+        for start in range(0, len(view), STREAM_CHUNK_SIZE):
+            self.wfile.write(view[start:start + STREAM_CHUNK_SIZE])
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+class SheetServerMixin():
+    daemon_threads = True
+
+    def setup_rendering(self, workers: int, max_concurrent: int, queue_timeout: float, render_timeout: float, watch_interval: float=None):
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker, initargs=(watch_interval,))
+        self._max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._queue_timeout = queue_timeout
+        self._render_timeout = render_timeout
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(cancel_futures=True)
+
+class SheetHTTPServer(SheetServerMixin, ThreadingHTTPServer):
+    pass
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class SheetUnixServer(SheetServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        pass
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on for HTTP requests.")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on for HTTP requests.")
+    parser.add_argument("--unix-socket", help="Listen on this Unix socket path instead of a TCP port.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of rendering processes. Defaults to the number of CPUs.")
+    parser.add_argument("--max-concurrent", type=int, default=16, help="Maximum number of sheets being rendered or queued at once.")
+    parser.add_argument("--queue-timeout", type=float, default=5, help="Seconds a request waits for a free slot before being rejected.")
+    parser.add_argument("--render-timeout", type=float, default=30, help="Seconds allowed to render a single sheet.")
+    parser.add_argument("--watch", nargs="?", type=float, const=1.0, default=None, metavar="INTERVAL",
+        help="Reload resource files when they change, checking every INTERVAL seconds (1 by default).")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    # forked workers inherit the warm compendium
+    compendium.get_compendium()
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = SheetUnixServer(args.unix_socket, SheetRequestHandler)
+    else:
+        server = SheetHTTPServer((args.host, args.port), SheetRequestHandler)
+    server.setup_rendering(args.workers, args.max_concurrent, args.queue_timeout, args.render_timeout, args.watch)
+    print(f"Serving ship sheets on {args.unix_socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,9 +1,31 @@
-import tkinter as tk
+from operator import attrgetter
 from typing import *
 from utils import *
 import re
 
+def get_tag_dice(tags: List[str], keyword: str) -> DiceExpr:
+    for tag in tags:
+        if keyword in tag:
+            match = re.match(pattern=rf"{keyword} (\d+(?:d\d+(?:\+\d+)?)?)", string=tag)
+            return DiceExpr.parse(match.group(1))
+    return DiceExpr.ONE
+
+_interned_tags = {}
+_interned_stats = {}
+
+def intern_tags(tags: List[str]) -> Tuple[str, ...]:
+    # a tuple rather than a set, the sheets list tags in their original order
+    tags = tuple(tags)
+    return _interned_tags.setdefault(tags, tags)
+
+def pack_stats(stats: Dict[ShipStat, int]) -> Tuple[int, ...]:
+    # indexed by ShipStat.value, with None for stats the element does not have
+    packed = tuple(stats.get(stat) for stat in ShipStat)
+    return _interned_stats.setdefault(packed, packed)
+
 class Craft():
+    __slots__ = ("_name", "_description", "_stats", "_tags", "_size", "_ammo", "_power", "_swarm")
+
     DEFAULT_CRAFT_STATS = {
         ShipStat.POWER: 0,
         ShipStat.AMMO: 0,
@@ -15,14 +37,15 @@ class Craft():
     def __init__(self, name: str, stats: Dict[str, int], size: int, ammo: int, power: int, description: str="", tags: List[str]=[]):
         self._name = name
         self._description = description
-        self._stats = stats.copy()
-        self._stats.update(Craft.DEFAULT_CRAFT_STATS)
-        self._tags = tags
+        self._stats = pack_stats({**stats, **Craft.DEFAULT_CRAFT_STATS})
+        self._tags = intern_tags(tags)
         self._size = size
         self._ammo = ammo
         self._power = power
+        # parsed once, the tags never change after loading
+        self._swarm = get_tag_dice(tags, "Swarm")
     
-    def get_tags(self) -> List[str]:
+    def get_tags(self) -> Tuple[str, ...]:
         return self._tags
     
     def get_size(self) -> int:
@@ -35,17 +58,19 @@ class Craft():
         return self._power
 
     def get_stat(self, stat: ShipStat):
-        return self._stats.get(stat)
+        return self._stats[stat.value]
     
     def get_swarm(self) -> str:
-        for tag in self._tags:
-            if "Swarm" in tag:
-                match = re.match(pattern=r"Swarm (\d+(?:d\d+(?:\+\d+)?)?)", string=tag)
-                return match.group(1)
-        return "1"
+        return str(self._swarm)
+
+    def get_swarm_dice(self) -> DiceExpr:
+        return self._swarm
     
     def get_damage(self) -> str:
         return "-"
+
+    def get_damage_dice(self) -> DiceExpr:
+        return DiceExpr.parse(self.get_damage(), strict=False) or DiceExpr.ZERO
     
     def get_ap(self) -> int:
         return 0
@@ -55,6 +80,8 @@ class Craft():
         raise NotImplementedError()
 
 class Weapon():
+    __slots__ = ("_name", "_size", "_range", "_description", "_power_cost", "_ammo_cost", "_ap", "_damage", "_tags", "_shots")
+
     def __init__(self, name: str, size: int, range: int, damage: str, ammo_cost: int=0, power_cost: int=0, ap: int=0, description: str="", tags: List[str]=[]):
         self._name = name
         self._size = size
@@ -64,16 +91,17 @@ class Weapon():
         self._ammo_cost = ammo_cost
         self._ap = ap
         self._damage = damage
-        self._tags = tags
+        self._tags = intern_tags(tags)
+        self._shots = DiceExpr.ONE if "EWAR" in tags else get_tag_dice(tags, "Shots")
     
     def get_shots(self) -> str:
-        if "EWAR" in self._tags:
-            return "1"
-        for tag in self._tags:
-            if "Shots" in tag:
-                match = re.match(pattern=r"Shots (\d+(?:d\d+(?:\+\d+)?)?)", string=tag)
-                return match.group(1)
-        return "1"
+        return str(self._shots)
+
+    def get_shots_dice(self) -> DiceExpr:
+        return self._shots
+
+    def get_damage_dice(self) -> DiceExpr:
+        return DiceExpr.parse(self._damage)
     
     def is_spinal(self) -> bool:
         return "Spinal" in self._tags
@@ -88,6 +116,8 @@ class Weapon():
         )
 
 class Payload(Craft):
+    __slots__ = ("_weapon",)
+
     def __init__(self, name: str, stats: Dict[str, int], weapon: Weapon, description: str="", tags: List[str]=[]):
         super().__init__(name, stats, weapon._size, weapon._ammo_cost, weapon._power_cost, description, tags)
         self._weapon = weapon
@@ -101,7 +131,7 @@ class Payload(Craft):
             json_obj["ammo"], json_obj["power"], json_obj["ap"], tags=json_obj["tags"]
         )
         stats = json_obj["stats"]
-        stats = {ShipStat[key.upper()]: value for key, value in stats.items() if key.upper() in [stat.name for stat in ShipStat]}
+        stats = {ShipStat[key.upper()]: value for key, value in stats.items() if key.upper() in ShipStat.__members__}
         return Payload(json_obj["name"], stats, weapon, tags=json_obj["tags"])
     
     def get_damage(self) -> str:
@@ -111,34 +141,47 @@ class Payload(Craft):
         return self._weapon._ap
 
 class Deployable(Craft):
+    __slots__ = ()
+
     @staticmethod
     def from_json(json_obj: dict):
         if not json_obj["__type__"] or json_obj["__type__"] != "Deployable":
             raise ValueError("Dict does not represent a Deployable")
         stats = json_obj["stats"]
-        stats = {ShipStat[key.upper()]: value for key, value in stats.items() if key.upper() in [stat.name for stat in ShipStat]}
+        stats = {ShipStat[key.upper()]: value for key, value in stats.items() if key.upper() in ShipStat.__members__}
         return Deployable(json_obj["name"], stats, json_obj["size"], json_obj["ammo"], json_obj["power"], tags=json_obj["tags"])
 
 class Mount():
-    def __init__(self, size: int, count: int, mount_type: MountType | str, position: MountPosition | str, is_spinal_only: bool=False, equip_restrictions: Callable[[Weapon], bool]=lambda w : True):
+    __slots__ = ("_size", "_count", "_type", "_position", "_weapon", "_frozen", "_is_spinal_only", "_equip_restrictions")
+
+    def __init__(self, size: int, count: int, mount_type: MountType | str, position: MountPosition | str, is_spinal_only: bool=False, equip_restrictions: Callable[[Weapon], bool]=None):
         self._size = size
         self._count = count
         self._type = MountType[mount_type] if type(mount_type) is str else mount_type
         self._position = MountPosition[position] if type(position) is str else position
         self._weapon = None
+        self._frozen = False
         self._is_spinal_only = is_spinal_only
-        self._equip_predicate = equip_restrictions
-        if not self._is_spinal_only:
-            self._equip_predicate = lambda w : equip_restrictions(w) and not w.is_spinal()
+        # kept as plain data rather than a closure so that mounts can be pickled
+        self._equip_restrictions = equip_restrictions
 
     def equip(self, weapon: Weapon) -> bool:
+        if self._frozen:
+            raise ValueError("This mount belongs to a ship template and cannot be modified, equip an instance of the ship instead")
         if self.can_equip(weapon):
             self._weapon = weapon
         else:
             raise ValueError(f"Weapon {weapon} cannot be equipped on this mount {self}")
         
     def can_equip(self, weapon: Weapon) -> bool:
-        return self._size >= weapon._size and self._equip_predicate(weapon)
+        return (self._size >= weapon._size and (self._is_spinal_only or not weapon.is_spinal())
+            and (self._equip_restrictions is None or self._equip_restrictions(weapon)))
+
+    def get_draw(self, weapon: Weapon) -> Tuple[int, int]:
+        # power and ammo to fire the weapon from every gun of this mount
+        if weapon is None:
+            return (0, 0)
+        return (weapon._power_cost * self._count, weapon._ammo_cost * self._count)
     
     @staticmethod
     def from_json(json_obj: dict):
@@ -151,21 +194,26 @@ class Mount():
         return mount
 
 class Bay():
-    def __init__(self, size: int, count: int, positions: List[MountPosition | str], equip_restrictions: Callable[[Craft], bool]=lambda w : True):
+    __slots__ = ("_size", "_count", "_positions", "_craft", "_frozen", "_equip_restrictions")
+
+    def __init__(self, size: int, count: int, positions: List[MountPosition | str], equip_restrictions: Callable[[Craft], bool]=None):
         self._size = size
         self._count = count
-        self._positions = [MountPosition[position] if type(position) is str else position for position in positions]
+        self._positions = tuple(MountPosition[position] if type(position) is str else position for position in positions)
         self._craft = None
-        self._equip_predicate = equip_restrictions
+        self._frozen = False
+        self._equip_restrictions = equip_restrictions
 
     def equip(self, craft: Craft) -> bool:
+        if self._frozen:
+            raise ValueError("This bay belongs to a ship template and cannot be modified, equip an instance of the ship instead")
         if self.can_equip(craft):
             self._craft = craft
         else:
             raise ValueError(f"Payload {craft._name} cannot be equipped on this mount")
         
     def can_equip(self, craft: Craft) -> bool:
-        return self._size >= craft.get_size() and self._equip_predicate(craft)
+        return self._size >= craft.get_size() and (self._equip_restrictions is None or self._equip_restrictions(craft))
 
     def get_count(self) -> int:
         if "Highlander" in self._craft.get_tags():
@@ -173,6 +221,13 @@ class Bay():
         else:
             return self._count
 
+    def get_draw(self, craft: Craft) -> Tuple[int, int]:
+        # power and ammo to launch the craft from every tube of this bay
+        if craft is None:
+            return (0, 0)
+        count = 1 if "Highlander" in craft.get_tags() else self._count
+        return (craft.get_power() * count, craft.get_ammo() * count)
+
     @staticmethod
     def from_json(json_obj: dict):
         if not json_obj["__type__"] or json_obj["__type__"] != "Bay":
@@ -187,6 +242,8 @@ class Bay():
 
 
 class ShipSystem():
+    __slots__ = ("_name", "_description", "_slots", "_hp", "_bubble_text", "_ship_classes")
+
     def __init__(self, name: str, description: str, slots: int, hp: int, bubble_text: List[str]=None, ship_classes: List[str]=None):
         self._name = name
         self._description = description
@@ -208,9 +265,12 @@ class ShipSystem():
             json_obj["name"], json_obj["description"], json_obj["slots"], json_obj["hp"], json_obj["bubble_text"], json_obj["ship_classes"])
 
 class Ship():
+    __slots__ = ("_name", "_stats", "_class", "_mounts", "_bays", "_systems", "_system_slots", "_point_cost", "_traits", "_id", "_frozen",
+        "_system_set", "_used_slots")
+
     def __init__(self, name: str, stats: Dict[str, int], system_slots: int, points: int, traits: Dict[str, str], ship_class: ShipClass, mounts: List[Mount], bays: List[Bay], systems: List[ShipSystem], id: str=""):
         self._name = name
-        self._stats = stats
+        self._stats = pack_stats(stats)
         self._class = ship_class
         self._mounts = mounts
         self._bays = bays
@@ -220,24 +280,60 @@ class Ship():
         self._traits = traits
         self._traits.update(self._class.get_traits())
         self._id = id
+        self._frozen = False
+        self._system_set = set(systems)
+        self._used_slots = sum(system._slots for system in systems)
+
+    def freeze(self):
+        self._frozen = True
+        for mount in self._mounts:
+            mount._frozen = True
+        for bay in self._bays:
+            bay._frozen = True
+        return self
+
+    def instantiate(self):
+        return ShipInstance(self)
     
     def get_free_system_slots(self):
-        return self._system_slots - sum(system._slots for system in self._systems)
+        return self._system_slots - self._used_slots
+
+    def get_power_draw(self) -> int:
+        return sum(mount.get_draw(mount._weapon)[0] for mount in self._mounts) + sum(bay.get_draw(bay._craft)[0] for bay in self._bays)
+
+    def get_ammo_draw(self) -> int:
+        return sum(mount.get_draw(mount._weapon)[1] for mount in self._mounts) + sum(bay.get_draw(bay._craft)[1] for bay in self._bays)
+
+    def has_system(self, system: ShipSystem) -> bool:
+        return system in self._system_set
     
     def get_stat(self, stat: ShipStat):
-        return self._stats.get(stat)
+        return self._stats[stat.value]
     
     def can_equip(self, system: ShipSystem):
         return (not system._ship_classes or self._class in system._ship_classes) and system._slots <= self.get_free_system_slots()
     
     def equip(self, system: ShipSystem):
-        if system in self._systems:
+        if self._frozen:
+            raise ValueError(f"{self._name} is a ship template and cannot be modified, equip an instance of the ship instead")
+        if system in self._system_set:
             return
         if self.can_equip(system):
             self._systems.append(system)
+            self._system_set.add(system)
+            self._used_slots += system._slots
         else:
             raise ValueError(f"System {system._name} cannot be equipped on this ship")
 
+    def unequip(self, system: ShipSystem):
+        if self._frozen:
+            raise ValueError(f"{self._name} is a ship template and cannot be modified, unequip an instance of the ship instead")
+        if system not in self._system_set:
+            raise ValueError(f"System {system._name} is not equipped on this ship")
+        self._systems.remove(system)
+        self._system_set.remove(system)
+        self._used_slots -= system._slots
+
     @staticmethod
     def from_json(json_obj: dict):
         if not json_obj["__type__"] or json_obj["__type__"] != "Ship":
@@ -249,25 +345,239 @@ class Ship():
             systems = [ShipSystem.from_json(system) for system in json_obj["systems"]]
         stats = json_obj["stats"]
         stats.update({"Power": stats["Reactor"]})
-        stats = {ShipStat[key.upper()]: value for key, value in stats.items() if key.upper() in [stat.name for stat in ShipStat]}
+        stats = {ShipStat[key.upper()]: value for key, value in stats.items() if key.upper() in ShipStat.__members__}
         return Ship(json_obj["name"], stats, json_obj["system_slots"], json_obj["point_cost"], json_obj["traits"],
             ShipClass[json_obj["ship_class"]], mounts, bays, systems
         )
     
+def _template_field(name: str) -> property:
+    # the inherited slots of an instance are empty, so its fields are read from the template instead
+    return property(attrgetter(f"_template.{name}"))
+
+class MountInstance(Mount):
+    __slots__ = ("_ship", "_index", "_template")
+
+    _size = _template_field("_size")
+    _count = _template_field("_count")
+    _type = _template_field("_type")
+    _position = _template_field("_position")
+    _frozen = _template_field("_frozen")
+    _is_spinal_only = _template_field("_is_spinal_only")
+    _equip_restrictions = _template_field("_equip_restrictions")
+
+    def __init__(self, ship: "ShipInstance", index: int):
+        self._ship = ship
+        self._index = index
+        self._template = ship._template._mounts[index]
+
+    def __reduce__(self):
+        return (MountInstance, (self._ship, self._index))
+
+    @property
+    def _weapon(self) -> Weapon:
+        return self._ship._mount_weapons.get(self._index, self._template._weapon)
+
+    def equip(self, weapon: Weapon) -> bool:
+        if self.can_equip(weapon):
+            self._ship.replace_draw(self.get_draw(self._weapon), self.get_draw(weapon))
+            self._ship._mount_weapons[self._index] = weapon
+        else:
+            raise ValueError(f"Weapon {weapon} cannot be equipped on this mount {self}")
+
+    def unequip(self):
+        self._ship.replace_draw(self.get_draw(self._weapon), (0, 0))
+        if self._template._weapon is None:
+            self._ship._mount_weapons.pop(self._index, None)
+        else:
+            self._ship._mount_weapons[self._index] = None
+
+class BayInstance(Bay):
+    __slots__ = ("_ship", "_index", "_template")
+
+    _size = _template_field("_size")
+    _count = _template_field("_count")
+    _positions = _template_field("_positions")
+    _frozen = _template_field("_frozen")
+    _equip_restrictions = _template_field("_equip_restrictions")
+
+    def __init__(self, ship: "ShipInstance", index: int):
+        self._ship = ship
+        self._index = index
+        self._template = ship._template._bays[index]
+
+    def __reduce__(self):
+        return (BayInstance, (self._ship, self._index))
+
+    @property
+    def _craft(self) -> Craft:
+        return self._ship._bay_crafts.get(self._index, self._template._craft)
+
+    def equip(self, craft: Craft) -> bool:
+        if self.can_equip(craft):
+            self._ship.replace_draw(self.get_draw(self._craft), self.get_draw(craft))
+            self._ship._bay_crafts[self._index] = craft
+        else:
+            raise ValueError(f"Payload {craft._name} cannot be equipped on this mount")
+
+    def unequip(self):
+        self._ship.replace_draw(self.get_draw(self._craft), (0, 0))
+        if self._template._craft is None:
+            self._ship._bay_crafts.pop(self._index, None)
+        else:
+            self._ship._bay_crafts[self._index] = None
+
+class ShipInstance(Ship):
+    # Only the equipment added over the template is stored, everything else is read from the template.
+    # Slot usage and power and ammo draw are kept up to date on every equip and unequip.
+    __slots__ = ("_template", "_mount_weapons", "_bay_crafts", "_added_systems", "_power_draw", "_ammo_draw",
+        "_mount_instances", "_bay_instances")
+
+    _name = _template_field("_name")
+    _stats = _template_field("_stats")
+    _class = _template_field("_class")
+    _system_slots = _template_field("_system_slots")
+    _point_cost = _template_field("_point_cost")
+    _traits = _template_field("_traits")
+    _id = _template_field("_id")
+    _system_set = _template_field("_system_set")
+
+    def __init__(self, template: Ship):
+        self._template = template
+        self._mount_weapons = {}
+        self._bay_crafts = {}
+        # used as an ordered set, so that systems can be removed in constant time
+        self._added_systems = {}
+        self._used_slots = template._used_slots
+        self._power_draw = template.get_power_draw()
+        self._ammo_draw = template.get_ammo_draw()
+        self._mount_instances = None
+        self._bay_instances = None
+
+    def __reduce__(self):
+        # the default slot state would read every template attribute through __getattr__
+        return (ShipInstance, (self._template,), (self._mount_weapons, self._bay_crafts, self._added_systems, self._used_slots, self._power_draw, self._ammo_draw))
+
+    def __setstate__(self, state: tuple):
+        self._mount_weapons, self._bay_crafts, self._added_systems, self._used_slots, self._power_draw, self._ammo_draw = state
+
+    @property
+    def _frozen(self) -> bool:
+        return False
+
+    @property
+    def _mounts(self) -> List[MountInstance]:
+        if self._mount_instances is None:
+            self._mount_instances = [MountInstance(self, index) for index in range(len(self._template._mounts))]
+        return self._mount_instances
+
+    @property
+    def _bays(self) -> List[BayInstance]:
+        if self._bay_instances is None:
+            self._bay_instances = [BayInstance(self, index) for index in range(len(self._template._bays))]
+        return self._bay_instances
+
+    @property
+    def _systems(self) -> List[ShipSystem]:
+        return self._template._systems + list(self._added_systems)
+
+    def get_power_draw(self) -> int:
+        return self._power_draw
+
+    def get_ammo_draw(self) -> int:
+        return self._ammo_draw
+
+    def replace_draw(self, old_draw: Tuple[int, int], new_draw: Tuple[int, int]):
+        self._power_draw += new_draw[0] - old_draw[0]
+        self._ammo_draw += new_draw[1] - old_draw[1]
+
+    def has_system(self, system: ShipSystem) -> bool:
+        return system in self._added_systems or system in self._template._system_set
+
+    def freeze(self):
+        raise ValueError("Ship instances cannot be frozen, only templates")
+
+    def instantiate(self):
+        ship = ShipInstance(self._template)
+        ship._mount_weapons = self._mount_weapons.copy()
+        ship._bay_crafts = self._bay_crafts.copy()
+        ship._added_systems = self._added_systems.copy()
+        ship._used_slots = self._used_slots
+        ship._power_draw = self._power_draw
+        ship._ammo_draw = self._ammo_draw
+        return ship
+
+    def equip(self, system: ShipSystem):
+        if self.has_system(system):
+            return
+        if self.can_equip(system):
+            self._added_systems[system] = None
+            self._used_slots += system._slots
+        else:
+            raise ValueError(f"System {system._name} cannot be equipped on this ship")
+
+    def unequip(self, system: ShipSystem):
+        if system not in self._added_systems:
+            if system in self._template._system_set:
+                raise ValueError(f"System {system._name} is part of the {self._name} template and cannot be removed")
+            raise ValueError(f"System {system._name} is not equipped on this ship")
+        del self._added_systems[system]
+        self._used_slots -= system._slots
+
+class Loadout():
+    __slots__ = ("_ship_name", "_weapons", "_crafts", "_systems", "_score")
+
+    def __init__(self, ship_name: str, weapons: List[Weapon]=None, crafts: List[Craft]=None, systems: List[ShipSystem]=None, score: float=None):
+        self._ship_name = ship_name
+        self._weapons = weapons or []
+        self._crafts = crafts or []
+        self._systems = systems or []
+        self._score = score
+
+    def equip(self, ship: Ship) -> Ship:
+        for system in self._systems:
+            ship.equip(system)
+        for weapon, mount in zip(self._weapons, ship._mounts):
+            if weapon:
+                mount.equip(weapon)
+        for craft, bay in zip(self._crafts, ship._bays):
+            if craft:
+                bay.equip(craft)
+        return ship
+
+    def to_json(self) -> dict:
+        # same layout as a batch manifest entry
+        json_obj = {
+            "ship": self._ship_name,
+            "weapons": [weapon._name if weapon else "" for weapon in self._weapons],
+            "crafts": [craft._name if craft else "" for craft in self._crafts],
+            "systems": [system._name for system in self._systems]
+        }
+        if self._score is not None:
+            json_obj["score"] = self._score
+        return json_obj
 
 class Army():
-    def __init__(self, max_points: int, ships: List[Ship]=[]):
+    def __init__(self, max_points: int, ships: List[Ship]=None):
         self._max_points = max_points
-        self._ships = ships
+        self._ships = list(ships) if ships else []
+        self._point_cost = sum(ship._point_cost for ship in self._ships)
     
     def get_point_cost(self):
-        return sum(ship._point_cost for ship in self._ships)
+        return self._point_cost
     
     def get_free_points(self):
         return self._max_points - self.get_point_cost()
+
+    def get_class_counts(self) -> Dict[ShipClass, int]:
+        counts = {ship_class: 0 for ship_class in ShipClass}
+        for ship in self._ships:
+            counts[ship._class] += 1
+        return counts
     
     def add_ship(self, ship: Ship):
         self._ships.append(ship)
+        self._point_cost += ship._point_cost
     
     def remove_ship(self, ship: Ship):
-        self._ships.remove(ship)
\ No newline at end of file
+        self._ships.remove(ship)
+        self._point_cost -= ship._point_cost
\ No newline at end of file
@@ -0,0 +1,183 @@
+import argparse
+import json
+import re
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+from utils import *
+from ship_configuration import *
+from dice_batch import roll_dice
+import compendium
+
+# every shot rolls this against the target's Evasion, modified by the Accurate and Inaccurate tags
+HIT_DICE = DiceExpr.parse("2d6")
+DEFAULT_BATCH_SIZE = 65536
+
+def get_accuracy(tags: List[str]) -> int:
+    accuracy = 0
+    for tag in tags:
+        match = re.match(pattern=r"(Inaccurate|Accurate) (\d+)", string=tag)
+        if match:
+            accuracy += int(match.group(2)) if match.group(1) == "Accurate" else -int(match.group(2))
+    return accuracy
+
+class Target():
+    def __init__(self, evasion: int=0, armour: int=0, shields: int=0):
+        self._evasion = evasion
+        self._armour = armour
+        self._shields = shields
+
+    @staticmethod
+    def from_ship(ship: Ship):
+        return Target(ship.get_stat(ShipStat.EVASION) or 0, ship.get_stat(ShipStat.ARMOUR) or 0, ship.get_stat(ShipStat.SHIELDS) or 0)
+
+    def to_json(self) -> dict:
+        return {"evasion": self._evasion, "armour": self._armour, "shields": self._shields}
+
+class Attack():
+    # One mount or bay firing once: a rolled number of shots, each rolling to hit and for damage.
+    def __init__(self, name: str, damage: DiceExpr, shots: DiceExpr, ap: int=0, accuracy: int=0):
+        self._name = name
+        self._damage = damage
+        self._shots = shots
+        self._ap = ap
+        self._accuracy = accuracy
+
+    def get_max_damage(self) -> int:
+        return self._shots.get_max() * self._damage.get_max()
+
+def get_attacks(ship: Ship) -> List[Attack]:
+    attacks = []
+    for mount in ship._mounts:
+        weapon = mount._weapon
+        if weapon:
+            attacks.append(Attack(weapon._name, weapon.get_damage_dice(), weapon.get_shots_dice() * mount._count, weapon._ap, get_accuracy(weapon._tags)))
+    for bay in ship._bays:
+        craft = bay._craft
+        # deployables have no damage roll
+        if craft and craft.get_damage_dice() != DiceExpr.ZERO:
+            attacks.append(Attack(craft._name, craft.get_damage_dice(), craft.get_swarm_dice() * bay.get_count(), craft.get_ap(), get_accuracy(craft.get_tags())))
+    return attacks
+
+class DamageStats():
+    # Summary of a damage histogram, where histogram[n] is the number of volleys dealing n damage.
+    def __init__(self, histogram: np.ndarray, shots: int=0, hits: int=0):
+        self._histogram = histogram
+        self._shots = shots
+        self._hits = hits
+        self._volleys = int(histogram.sum())
+        damage = np.arange(len(histogram))
+        self._mean = float((histogram * damage).sum() / self._volleys) if self._volleys else 0.0
+        variance = float((histogram * (damage - self._mean) ** 2).sum() / self._volleys) if self._volleys else 0.0
+        self._std = variance ** 0.5
+        nonzero = np.flatnonzero(histogram)
+        self._min = int(nonzero[0]) if len(nonzero) else 0
+        self._max = int(nonzero[-1]) if len(nonzero) else 0
+
+    def get_percentile(self, percentile: float) -> int:
+        cumulative = np.cumsum(self._histogram)
+        return int(np.searchsorted(cumulative, percentile / 100 * self._volleys))
+
+    def get_hit_rate(self) -> float:
+        return self._hits / self._shots if self._shots else 0.0
+
+    def to_json(self) -> dict:
+        summary = {"mean": self._mean, "std": self._std, "min": self._min, "max": self._max,
+            "p10": self.get_percentile(10), "p50": self.get_percentile(50), "p90": self.get_percentile(90)}
+        if self._shots:
+            summary["hit_rate"] = self.get_hit_rate()
+        return summary
+
+class SimulationResult():
+    def __init__(self, ship_name: str, target: Target, ship_stats: DamageStats, weapon_stats: Dict[str, DamageStats], elapsed: float):
+        self._ship_name = ship_name
+        self._target = target
+        self._ship_stats = ship_stats
+        self._weapon_stats = weapon_stats
+        self._elapsed = elapsed
+
+    def to_json(self) -> dict:
+        return {
+            "ship": self._ship_name,
+            "target": self._target.to_json(),
+            "volleys": self._ship_stats._volleys,
+            "damage": self._ship_stats.to_json(),
+            "weapons": {name: stats.to_json() for name, stats in self._weapon_stats.items()},
+        }
+
+def _simulate_volleys(attacks: List[Attack], target: Target, volleys: int, seed: np.random.SeedSequence, batch_size: int) -> Tuple[np.ndarray, Dict[str, list]]:
+    rng = np.random.default_rng(seed)
+    names = list(dict.fromkeys(attack._name for attack in attacks))
+    weapon_counts = {name: [np.zeros(1 + sum(attack.get_max_damage() for attack in attacks if attack._name == name), dtype=np.int64), 0, 0]
+        for name in names}
+    ship_histogram = np.zeros(1 + sum(attack.get_max_damage() for attack in attacks), dtype=np.int64)
+    remaining = volleys
+    while remaining > 0:
+        batch = min(batch_size, remaining)
+        remaining -= batch
+        weapon_damage = {name: np.zeros(batch, dtype=np.int64) for name in names}
+        for attack in attacks:
+            shots = roll_dice(rng, attack._shots, batch)
+            total_shots = int(shots.sum())
+            hits = roll_dice(rng, HIT_DICE, total_shots) + attack._accuracy >= target._evasion
+            # armour reduces every hit, armour piercing reduces the armour
+            damage = np.maximum(roll_dice(rng, attack._damage, total_shots) - max(0, target._armour - attack._ap), 0) * hits
+            weapon_damage[attack._name] += np.bincount(np.repeat(np.arange(batch), shots), weights=damage, minlength=batch).astype(np.int64)
+            weapon_counts[attack._name][1] += total_shots
+            weapon_counts[attack._name][2] += int(hits.sum())
+        # shields absorb damage from the whole volley before it reaches the hull
+        ship_damage = np.maximum(sum(weapon_damage.values(), np.zeros(batch, dtype=np.int64)) - target._shields, 0)
+        ship_histogram += np.bincount(ship_damage, minlength=len(ship_histogram))
+        for name, damage in weapon_damage.items():
+            weapon_counts[name][0] += np.bincount(damage, minlength=len(weapon_counts[name][0]))
+    return ship_histogram, weapon_counts
+
+def simulate(ship: Ship, target: Target, volleys: int=1000000, seed: int=None, jobs: int=1, batch_size: int=DEFAULT_BATCH_SIZE) -> SimulationResult:
+    attacks = get_attacks(ship)
+    start_time = time.perf_counter()
+    # results are reproducible for a given seed and number of jobs
+    seeds = np.random.SeedSequence(seed).spawn(jobs)
+    shares = [volleys // jobs + (1 if index < volleys % jobs else 0) for index in range(jobs)]
+    if jobs == 1:
+        results = [_simulate_volleys(attacks, target, volleys, seeds[0], batch_size)]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_simulate_volleys, attacks, target, share, job_seed, batch_size) for share, job_seed in zip(shares, seeds)]
+            results = [future.result() for future in futures]
+    ship_histogram = sum(result[0] for result in results)
+    weapon_stats = {}
+    for name in results[0][1]:
+        histogram = sum(result[1][name][0] for result in results)
+        weapon_stats[name] = DamageStats(histogram, sum(result[1][name][1] for result in results), sum(result[1][name][2] for result in results))
+    return SimulationResult(ship._name, target, DamageStats(ship_histogram), weapon_stats, time.perf_counter() - start_time)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--ship", required=True, help="The name of the attacking ship. Ex: Emblem")
+    parser.add_argument("-w", "--weapons", nargs="*", help="List of weapon names to equip on the attacking ship, in order.")
+    parser.add_argument("-c", "--crafts", nargs="*", help="List of craft names to equip on the attacking ship, in order.")
+    parser.add_argument("-t", "--target", help="Use the Evasion, Armour and Shields of this ship as the target.")
+    parser.add_argument("--evasion", type=int, default=0, help="Target Evasion, when no target ship is given.")
+    parser.add_argument("--armour", type=int, default=0, help="Target Armour, when no target ship is given.")
+    parser.add_argument("--shields", type=int, default=0, help="Target Shields, when no target ship is given.")
+    parser.add_argument("-n", "--volleys", type=int, default=1000000, help="Number of volleys to simulate.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the random number generator.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    comp = compendium.get_compendium()
+    ship = comp.create_ship(args.ship, args.weapons, args.crafts)
+    if args.target:
+        target_ship = comp.get_ship(args.target)
+        if target_ship is None:
+            raise ValueError(f"Ship {args.target} does not exist in the compendium")
+        target = Target.from_ship(target_ship)
+    else:
+        target = Target(args.evasion, args.armour, args.shields)
+    result = simulate(ship, target, args.volleys, args.seed, args.jobs)
+    print(json.dumps(result.to_json(), indent=4))
+    print(f"Simulated {args.volleys} volleys in {result._elapsed:.2f}s", file=sys.stderr)
@@ -1,4 +1,7 @@
+from collections import OrderedDict
 from enum import Enum
+from typing import *
+import os
 import re
 
 class MountType(Enum):
@@ -59,15 +62,150 @@ class ShipStat(Enum):
     def is_gauge(self) -> bool:
         return self.value < 5
 
+DICE_PATTERN = re.compile(r"(\d+)(?:d(\d+))?((?:\+\d+(?:d\d+)?)*)$")
+DICE_TERM_PATTERN = re.compile(r"\+(\d+)(?:d(\d+))?")
+
+class DiceExpr():
+    # A sum of dice and a constant, e.g. 2d6+3. Instances are interned, so they must never be modified.
+    __slots__ = ("_dice", "_constant", "_distribution")
+    _interned = {}
+    _parsed = {}
+
+    def __init__(self, dice: Tuple[Tuple[int, int], ...]=(), constant: int=0):
+        self._dice = dice
+        self._constant = constant
+        self._distribution = None
+
+    @staticmethod
+    def create(dice: Dict[int, int] | Tuple[Tuple[int, int], ...]=(), constant: int=0) -> "DiceExpr":
+        counts = {}
+        for count, size in (dice.items() if isinstance(dice, dict) else dice):
+            if count:
+                counts[size] = counts.get(size, 0) + count
+        key = (tuple((count, size) for size, count in sorted(counts.items(), reverse=True)), constant)
+        expr = DiceExpr._interned.get(key)
+        if expr is None:
+            expr = DiceExpr._interned.setdefault(key, DiceExpr(*key))
+        return expr
+
+    @staticmethod
+    def parse(dice: str, strict: bool=True) -> "DiceExpr":
+        # failed parses are cached too, so that e.g. the "-" damage of deployables is only matched once
+        if dice in DiceExpr._parsed:
+            expr = DiceExpr._parsed[dice]
+        else:
+            expr = DiceExpr._parse(dice)
+            DiceExpr._parsed[dice] = expr
+        if expr is None and strict:
+            raise ValueError(f"`{dice}` is not a dice expression such as 2d6+3")
+        return expr
+
+    @staticmethod
+    def _parse(dice: str) -> "DiceExpr":
+        match = DICE_PATTERN.match(dice.strip())
+        if not match:
+            return None
+        terms = [(match.group(1), match.group(2))] + DICE_TERM_PATTERN.findall(match.group(3))
+        dice_terms = [(int(count), int(size)) for count, size in terms if size]
+        constant = sum(int(count) for count, size in terms if not size)
+        return DiceExpr.create(dice_terms, constant)
+
+    def __mul__(self, factor: int) -> "DiceExpr":
+        if not isinstance(factor, int):
+            return NotImplemented
+        return DiceExpr.create(tuple((count * factor, size) for count, size in self._dice), self._constant * factor)
+
+    __rmul__ = __mul__
+
+    def __add__(self, other: "DiceExpr | int") -> "DiceExpr":
+        if isinstance(other, int):
+            return DiceExpr.create(self._dice, self._constant + other)
+        if not isinstance(other, DiceExpr):
+            return NotImplemented
+        return DiceExpr.create(self._dice + other._dice, self._constant + other._constant)
+
+    __radd__ = __add__
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DiceExpr) and (self._dice, self._constant) == (other._dice, other._constant)
+
+    def __hash__(self) -> int:
+        return hash((self._dice, self._constant))
+
+    def __reduce__(self):
+        # unpickled values are interned like parsed ones
+        return (DiceExpr.create, (self._dice, self._constant))
+
+    def __str__(self) -> str:
+        terms = [f"{count}d{size}" for count, size in self._dice]
+        if self._constant or not terms:
+            terms.append(str(self._constant))
+        return "+".join(terms)
+
+    def __repr__(self) -> str:
+        return f"DiceExpr({self})"
+
+    def is_constant(self) -> bool:
+        return not self._dice
+
+    def get_min(self) -> int:
+        return sum(count for count, size in self._dice) + self._constant
+
+    def get_max(self) -> int:
+        return sum(count * size for count, size in self._dice) + self._constant
+
+    def mean(self) -> float:
+        return float(sum(count * (size + 1) / 2 for count, size in self._dice) + self._constant)
+
+    def variance(self) -> float:
+        return float(sum(count * (size * size - 1) / 12 for count, size in self._dice))
+
+    def distribution(self) -> Dict[int, float]:
+        if self._distribution is None:
+            probabilities = [1.0]
+            for count, size in self._dice:
+                for roll in range(count):
+                    rolled = [0.0] * (len(probabilities) + size - 1)
+                    for total, probability in enumerate(probabilities):
+                        for face in range(size):
+                            rolled[total + face] += probability / size
+                    probabilities = rolled
+            offset = self.get_min()
+            self._distribution = {offset + total: probability for total, probability in enumerate(probabilities)}
+        return dict(self._distribution)
+
+DiceExpr.ZERO = DiceExpr.create()
+DiceExpr.ONE = DiceExpr.create(constant=1)
+
 def multiply_dice(dice: str, constant: int) -> str:
-    if dice.isdigit():
-        return str(int(dice) * constant)
-    else:
-        match = re.match(pattern=r"(\d+)d(\d+)(?:\+(\d+))?", string=dice)
-        dice_count = int(match.group(1)) * constant
-        dice_size = int(match.group(2))
-        calculated_string = f"{dice_count}d{dice_size}"
-        if len(match.groups()) > 2 and match.group(3):
-            added_value = int(match.group(3))
-            calculated_string += f"+{added_value * constant}"
-        return calculated_string
\ No newline at end of file
+    return str(DiceExpr.parse(dice) * constant)
+
+class LRUCache():
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def remove_if(self, predicate: Callable[[Any, Any], bool]):
+        for key in [key for key, value in self._entries.items() if predicate(key, value)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+def get_cache_dir() -> str:
+    if os.environ.get("ORION_CACHE_DIR"):
+        return os.environ["ORION_CACHE_DIR"]
+    base_dir = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base_dir, "project-orion")
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from typing import *
+from utils import *
+from ship_configuration import *
+from compendium import Compendium
+from lazy_compendium import get_resource_files
+
+# every check is a description of the expected value, and a predicate on the value
+NON_NEGATIVE = ("a non-negative integer", lambda value: type(value) is int and value >= 0)
+POSITIVE = ("a positive integer", lambda value: type(value) is int and value > 0)
+STRING = ("a string", lambda value: isinstance(value, str))
+NAME = ("a non-empty string", lambda value: isinstance(value, str) and value.strip() != "")
+BOOLEAN = ("true or false", lambda value: type(value) is bool)
+STRING_LIST = ("a list of strings", lambda value: isinstance(value, list) and all(isinstance(item, str) for item in value))
+OPTIONAL_STRING_LIST = ("null or a list of strings", lambda value: value is None or STRING_LIST[1](value))
+DICE = ("a dice expression such as 3, 2d6 or 1d6+2", lambda value: isinstance(value, str) and DiceExpr.parse(value, strict=False) is not None)
+OBJECT = ("an object", lambda value: isinstance(value, dict))
+LIST = ("a list", lambda value: isinstance(value, list))
+
+def enum_check(enum: Type[Enum]) -> Tuple[str, Callable]:
+    return (f"one of {', '.join(enum.__members__.keys())}", lambda value: isinstance(value, str) and value in enum.__members__)
+
+def enum_list_check(enum: Type[Enum], optional: bool=False) -> Tuple[str, Callable]:
+    description = f"a list of {', '.join(enum.__members__.keys())}"
+    return ("null or " + description if optional else description,
+        lambda value: (optional and value is None) or (isinstance(value, list) and all(isinstance(item, str) and item in enum.__members__ for item in value)))
+
+# required fields of every element type, optional fields may also be null
+SCHEMAS = {
+    "Weapon": {"name": NAME, "size": POSITIVE, "range": NON_NEGATIVE, "damage": DICE, "ammo": NON_NEGATIVE, "power": NON_NEGATIVE,
+        "ap": NON_NEGATIVE, "tags": STRING_LIST},
+    "Payload": {"name": NAME, "size": POSITIVE, "stats": OBJECT, "damage": DICE, "ammo": NON_NEGATIVE, "power": NON_NEGATIVE,
+        "ap": NON_NEGATIVE, "tags": STRING_LIST},
+    "Deployable": {"name": NAME, "size": POSITIVE, "stats": OBJECT, "ammo": NON_NEGATIVE, "power": NON_NEGATIVE, "tags": STRING_LIST},
+    "ShipSystem": {"name": NAME, "description": STRING, "slots": NON_NEGATIVE, "hp": NON_NEGATIVE, "bubble_text": OPTIONAL_STRING_LIST,
+        "ship_classes": enum_list_check(ShipClass, optional=True)},
+    "Ship": {"name": NAME, "ship_class": enum_check(ShipClass), "stats": OBJECT, "system_slots": NON_NEGATIVE, "point_cost": NON_NEGATIVE,
+        "traits": OBJECT, "mounts": LIST, "bays": LIST},
+    "Mount": {"size": POSITIVE, "count": POSITIVE, "type": enum_check(MountType), "position": enum_check(MountPosition), "spinal": BOOLEAN},
+    "Bay": {"size": POSITIVE, "count": POSITIVE, "positions": enum_list_check(MountPosition)},
+}
+OPTIONAL_FIELDS = {
+    "Ship": {"systems": LIST},
+    "Mount": {"weapon": OBJECT},
+    "Bay": {"payload": OBJECT, "deployable": OBJECT},
+}
+# nested elements and the type they must have
+NESTED_ELEMENTS = {
+    "Ship": {"mounts": "Mount", "bays": "Bay", "systems": "ShipSystem"},
+    "Mount": {"weapon": "Weapon"},
+    "Bay": {"payload": "Payload", "deployable": "Deployable"},
+}
+# outside of ShipStat, ship stats also have the Reactor, which becomes their Power
+EXTRA_STATS = {"Ship": {"REACTOR"}}
+DICE_TAGS = ["Shots", "Swarm"]
+TOP_LEVEL_TYPES = ["Weapon", "Payload", "Deployable", "ShipSystem", "Ship"]
+DEFAULT_CHUNK_SIZE = 1000
+
+ELEMENT_LOADERS = {
+    "Weapon": Weapon.from_json,
+    "Payload": Payload.from_json,
+    "Deployable": Deployable.from_json,
+    "ShipSystem": ShipSystem.from_json,
+    "Ship": Ship.from_json,
+    "Mount": Mount.from_json,
+    "Bay": Bay.from_json,
+}
+
+class ValidationError():
+    def __init__(self, path: str, location: str, message: str, name: str=None, field: str=None):
+        self._path = path
+        self._location = location
+        self._message = message
+        self._name = name
+        self._field = field
+
+    def to_json(self) -> dict:
+        return {"path": self._path, "location": self._location, "name": self._name, "field": self._field, "message": self._message}
+
+def check_element(json_obj, element_type: str, path: str, location: str, name: str=None) -> List[ValidationError]:
+    # Collects every schema error of an element and its nested elements, then builds it to catch anything the schema missed.
+    if not isinstance(json_obj, dict):
+        return [ValidationError(path, location, f"Expected a {element_type} object", name)]
+    name = json_obj.get("name") if isinstance(json_obj.get("name"), str) else name
+    if json_obj.get("__type__") != element_type:
+        return [ValidationError(path, location, f"`__type__` is {json_obj.get('__type__')!r}, expected {element_type!r}", name, "__type__")]
+    errors = []
+    def add_error(message: str, field: str=None):
+        errors.append(ValidationError(path, location, message, name, field))
+    for field, (description, check) in SCHEMAS[element_type].items():
+        if field not in json_obj:
+            add_error(f"Missing field `{field}`", field)
+        elif not check(json_obj[field]):
+            add_error(f"`{field}` is {json_obj[field]!r}, expected {description}", field)
+    for field, (description, check) in OPTIONAL_FIELDS.get(element_type, {}).items():
+        if json_obj.get(field) is not None and not check(json_obj[field]):
+            add_error(f"`{field}` is {json_obj[field]!r}, expected null or {description}", field)
+    if isinstance(json_obj.get("stats"), dict):
+        stat_names = set(ShipStat.__members__.keys()) | EXTRA_STATS.get(element_type, set())
+        for stat, value in json_obj["stats"].items():
+            if stat.upper() not in stat_names:
+                add_error(f"Unknown stat `{stat}`, expected one of {', '.join(sorted(stat_names))}", "stats")
+            elif type(value) is not int:
+                add_error(f"Stat `{stat}` is {value!r}, expected an integer", "stats")
+        if element_type == "Ship" and "Reactor" not in json_obj["stats"]:
+            add_error("Missing stat `Reactor`", "stats")
+    if STRING_LIST[1](json_obj.get("tags")):
+        for keyword in DICE_TAGS:
+            for tag in json_obj["tags"]:
+                if keyword not in tag:
+                    continue
+                match = re.fullmatch(rf"{keyword} (.+)", tag)
+                if not (match and DiceExpr.parse(match.group(1), strict=False)):
+                    add_error(f"Tag `{tag}` must be `{keyword}` followed by a dice expression, such as `{keyword} 2` or `{keyword} 1d6`", "tags")
+    if element_type == "ShipSystem" and isinstance(json_obj.get("bubble_text"), list) and type(json_obj.get("hp")) is int \
+            and len(json_obj["bubble_text"]) != json_obj["hp"]:
+        add_error(f"`bubble_text` has {len(json_obj['bubble_text'])} elements, must be the same as `hp` ({json_obj['hp']})", "bubble_text")
+    for field, nested_type in NESTED_ELEMENTS.get(element_type, {}).items():
+        nested = json_obj.get(field)
+        if isinstance(nested, list):
+            for index, nested_obj in enumerate(nested):
+                errors.extend(check_element(nested_obj, nested_type, path, f"{location}.{field}[{index}]", name))
+        elif isinstance(nested, dict):
+            errors.extend(check_element(nested, nested_type, path, f"{location}.{field}", name))
+    if not errors and element_type == "Mount" and json_obj.get("weapon"):
+        mount = Mount.from_json(dict(json_obj, weapon=None))
+        weapon = Weapon.from_json(json_obj["weapon"])
+        if not mount.can_equip(weapon):
+            add_error(f"Weapon {weapon._name} (size {weapon._size}{', spinal' if weapon.is_spinal() else ''}) cannot be equipped on "
+                f"a size {mount._size}{' spinal' if mount._is_spinal_only else ''} mount", "weapon")
+    for field, craft_type in [("payload", Payload), ("deployable", Deployable)]:
+        if not errors and element_type == "Bay" and json_obj.get(field):
+            bay = Bay.from_json(dict(json_obj, payload=None, deployable=None))
+            craft = craft_type.from_json(json_obj[field])
+            if not bay.can_equip(craft):
+                add_error(f"Craft {craft._name} (size {craft.get_size()}) cannot be equipped on a size {bay._size} bay", field)
+    if not errors:
+        try:
+            # ships add their Power to the stats they are given
+            ELEMENT_LOADERS[element_type](dict(json_obj, stats=dict(json_obj["stats"])) if element_type == "Ship" else json_obj)
+        except Exception as e:
+            # e.g. a weapon or craft that the mount or bay it is given to cannot equip
+            add_error(f"{type(e).__name__}: {e}")
+    return errors
+
+def read_elements(path: str) -> Tuple[List[Tuple[str, dict]], List[ValidationError]]:
+    # Every element of a resource file with its location, in any of the list, JSONL or one element per file layouts.
+    elements = []
+    errors = []
+    documents = []
+    try:
+        with open(path, "r", encoding="utf-8") as resource_file:
+            if path.lower().endswith(".jsonl"):
+                for number, line in enumerate(resource_file, 1):
+                    if not line.strip():
+                        continue
+                    # a malformed line only loses that line, the others are still checked
+                    try:
+                        documents.append((f"line {number}", json.loads(line)))
+                    except ValueError as e:
+                        errors.append(ValidationError(path, f"line {number}", f"{type(e).__name__}: {e}"))
+            else:
+                documents = [("", json.load(resource_file))]
+    except (OSError, ValueError) as e:
+        return [], errors + [ValidationError(path, "", f"{type(e).__name__}: {e}")]
+    for location, document in documents:
+        if isinstance(document, dict) and "__type__" in document:
+            elements.append((location or "$", document))
+        elif isinstance(document, dict):
+            for section, section_elements in document.items():
+                if not isinstance(section_elements, list):
+                    errors.append(ValidationError(path, f"{location}{section}".strip(), f"`{section}` must be a list of elements"))
+                    continue
+                elements.extend((f"{location} {section}[{index}]".strip(), element) for index, element in enumerate(section_elements))
+        else:
+            errors.append(ValidationError(path, location or "$", "Expected an object"))
+    return elements, errors
+
+def check_elements(path: str, elements: List[Tuple[str, dict]]) -> List[ValidationError]:
+    errors = []
+    for location, json_obj in elements:
+        element_type = json_obj.get("__type__") if isinstance(json_obj, dict) else None
+        if element_type not in TOP_LEVEL_TYPES:
+            errors.append(ValidationError(path, location, f"`__type__` is {element_type!r}, expected one of {', '.join(TOP_LEVEL_TYPES)}"))
+            continue
+        errors.extend(check_element(json_obj, element_type, path, location))
+    return errors
+
+def check_duplicates(paths: List[str], elements: Dict[str, List[Tuple[str, dict]]]) -> List[ValidationError]:
+    # only the first element of a name is used by the compendium
+    errors = []
+    seen = {}
+    for path in paths:
+        for location, json_obj in elements[path]:
+            if not isinstance(json_obj, dict) or not isinstance(json_obj.get("name"), str):
+                continue
+            element_type = json_obj.get("__type__")
+            kind = "Craft" if element_type in ["Payload", "Deployable"] else element_type
+            key = (kind, json_obj["name"].lower())
+            if key in seen:
+                first_path, first_location = seen[key]
+                errors.append(ValidationError(path, location, f"Duplicate {kind} name, already defined at {first_location} in {first_path}", json_obj["name"], "name"))
+            else:
+                seen[key] = (path, location)
+    return errors
+
+class ValidationReport():
+    def __init__(self, paths: List[str], element_count: int, errors: List[ValidationError], elapsed: float):
+        self._paths = paths
+        self._element_count = element_count
+        self._errors = errors
+        self._elapsed = elapsed
+
+    def is_valid(self) -> bool:
+        return not self._errors
+
+    def to_json(self) -> dict:
+        return {
+            "valid": self.is_valid(),
+            "files": self._paths,
+            "elements": self._element_count,
+            "error_count": len(self._errors),
+            "errors": [error.to_json() for error in self._errors],
+        }
+
+def validate(paths: List[str]=None, jobs: int=None, chunk_size: int=DEFAULT_CHUNK_SIZE) -> ValidationReport:
+    start_time = time.perf_counter()
+    paths = paths or [Compendium.WEAPON_LIST, Compendium.CRAFT_LIST, Compendium.SYSTEM_LIST, Compendium.SHIP_LIST]
+    files = []
+    for path in paths:
+        files.extend(get_resource_files(path) if os.path.isdir(path) else [path])
+    elements = {}
+    errors = []
+    for path in files:
+        elements[path], read_errors = read_elements(path)
+        errors.extend(read_errors)
+    # large files are split so that every worker has a share of the elements
+    chunks = [(path, elements[path][start:start + chunk_size]) for path in files for start in range(0, len(elements[path]), chunk_size)]
+    if jobs == 1 or len(chunks) <= 1:
+        results = [check_elements(path, chunk) for path, chunk in chunks]
+    else:
+        # imported only when the checks are spread over workers, to keep startup fast
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(check_elements, *zip(*chunks)))
+    for result in results:
+        errors.extend(result)
+    errors.extend(check_duplicates(files, elements))
+    return ValidationReport(files, sum(len(file_elements) for file_elements in elements.values()), errors, time.perf_counter() - start_time)
+
+def parse_args(argv: List[str]=None):
+    parser = argparse.ArgumentParser(prog="cli.py validate", description="Check every element of the compendium and report all errors as JSON.")
+    parser.add_argument("paths", nargs="*", help="Resource files or directories to check. Defaults to the bundled compendium files.")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file instead of standard output.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+    args = parser.parse_args(argv)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j/--jobs must be at least 1")
+    return args
+
+def main(argv: List[str]=None) -> int:
+    args = parse_args(argv)
+    report = validate(args.paths, args.jobs)
+    report_json = json.dumps(report.to_json(), indent=4)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(report_json)
+    else:
+        print(report_json)
+    print(f"Checked {report._element_count} elements in {len(report._paths)} files in {report._elapsed:.2f}s, found {len(report._errors)} errors",
+        file=sys.stderr)
+    return 0 if report.is_valid() else 1
+
+if __name__ == "__main__":
+    sys.exit(main())